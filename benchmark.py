@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import json
+import random
+import optparse
+import datetime
+import configparser
+import numpy as np
+
+from utils import import_train_configuration, set_sumo, set_train_path
+import runner
+
+
+METRICS = ['episodes_per_hour', 'decisions_per_second', 'batches_per_second']
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--config", default="benchmark_settings.ini",
+                         help="fixed training configuration of the benchmark")
+    optParser.add_option("--save-baseline", dest="save_baseline", action="store_true", default=False,
+                         help="store the results as the new baseline instead of comparing with it")
+    options, args = optParser.parse_args()
+    return options
+
+
+def import_benchmark_configuration(config_file):
+    """
+    Read the [benchmark] section of the config file: seed, baseline file and relative tolerance of every metric
+    """
+    content = configparser.ConfigParser()
+    content.read(config_file)
+    config = {}
+    config['seed'] = content['benchmark'].getint('seed')
+    config['baseline_file'] = content['benchmark']['baseline_file']
+    config['tolerances'] = {metric: content['benchmark'].getfloat('tolerance_' + metric) for metric in METRICS}
+    return config
+
+
+def compute_throughput(timings):
+    """
+    Convert the timings of a training session to throughput metrics
+    """
+    return {
+        'episodes_per_hour': timings['episodes'] / timings['total'] * 3600,
+        'decisions_per_second': timings['decisions'] / timings['simulation'] if timings['simulation'] > 0 else 0,
+        'batches_per_second': timings['batches'] / timings['training'] if timings['training'] > 0 else 0,
+    }
+
+
+def compare(results, baseline, tolerances):
+    """
+    Return the metrics that are slower than the baseline by more than their relative tolerance
+    """
+    regressions = []
+    for metric in METRICS:
+        if metric in baseline and results[metric] < baseline[metric] * (1 - tolerances[metric]):
+            regressions.append(metric)
+    return regressions
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    config = import_train_configuration(config_file=options.config)
+    benchmark = import_benchmark_configuration(options.config)
+
+    # pin every source of randomness, the episodes are generated from their index as seed
+    random.seed(benchmark['seed'])
+    np.random.seed(benchmark['seed'])
+    import tensorflow as tf
+    tf.random.set_seed(benchmark['seed'])
+
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+    path = set_train_path(config['models_path_name'])
+    timings = runner.train_session(config, options.config, path, os.path.join('intersection', 'routes.rou.xml'), sumo_cmd, runner.build_model(config), runner.build_memory(config))
+    results = compute_throughput(timings)
+    results['timings'] = timings
+    results['date'] = datetime.datetime.now().isoformat()
+
+    print("\n----- Benchmark results")
+    for metric in METRICS:
+        print(metric, "=", round(results[metric], 2))
+
+    if options.save_baseline or not os.path.isfile(benchmark['baseline_file']):
+        os.makedirs(os.path.dirname(benchmark['baseline_file']) or '.', exist_ok=True)
+        with open(benchmark['baseline_file'], "w") as file:
+            json.dump(results, file, indent=4)
+        print("----- Baseline saved at:", benchmark['baseline_file'])
+        sys.exit(0)
+
+    with open(benchmark['baseline_file'], "r") as file:
+        baseline = json.load(file)
+    with open(os.path.join(path, 'benchmark.json'), "w") as file:
+        json.dump(results, file, indent=4)
+
+    regressions = compare(results, baseline, benchmark['tolerances'])
+    for metric in METRICS:
+        print(metric, "- baseline:", round(baseline[metric], 2), "- now:", round(results[metric], 2), "(REGRESSION)" if metric in regressions else "")
+    if regressions:
+        sys.exit("----- Throughput regression in: " + ", ".join(regressions))
+    print("----- No regression")
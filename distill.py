@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import timeit
+import numpy as np
+
+from model import TrainModel, TestModel
+from utils import import_test_configuration, set_sumo, set_test_path
+from state_encoder import is_binary
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--config", default="testing_settings.ini",
+                         help="testing settings file, it defines the teacher model (model_to_test) and the evaluation episode")
+    optParser.add_option("--layers", type="int", default=1, help="hidden layers of the student after the first one")
+    optParser.add_option("--width", type="int", default=64, help="width of the hidden layers of the student")
+    optParser.add_option("--epochs", type="int", default=50, help="passes over the recorded states")
+    optParser.add_option("--batch-size", dest="batch_size", type="int", default=128, help="states per training batch")
+    optParser.add_option("--learning-rate", dest="learning_rate", type="float", default=0.001, help="learning rate of the student")
+    optParser.add_option("--augment", type="int", default=4,
+                         help="perturbed copies of every recorded state (a few occupancy cells flipped) to cover more states")
+    optParser.add_option("--evaluate", action="store_true", default=False,
+                         help="run the testing episode with the teacher and the student and compare their metrics")
+    options, args = optParser.parse_args()
+    return options
+
+
+def load_states(model_path, rng):
+    """
+    Load the states recorded while training the teacher, in random order
+    """
+    states_file = os.path.join(model_path, 'recorded_states.npy')
+    if not os.path.isfile(states_file):
+        sys.exit("No recorded states in the model folder, they are saved by runner.py with the model")
+    states = np.load(states_file)
+    rng.shuffle(states)
+    return states
+
+
+def augment_states(states, augment, rng):
+    """
+    Add perturbed copies of the states, flipping a few cells of every state
+    """
+    copies = [states]
+    for _ in range(augment):
+        flips = rng.uniform(size=states.shape) < 2 / states.shape[1]  # about two cells per state
+        copies.append(np.abs(states - flips))
+    states = np.concatenate(copies)
+    rng.shuffle(states)
+    return states
+
+
+def measure_latency(model, states):
+    """
+    Return the mean time of a single decision in milliseconds
+    """
+    start_time = timeit.default_timer()
+    for state in states:
+        model.predict_one(state)
+    return (timeit.default_timer() - start_time) / len(states) * 1000
+
+
+def evaluate(model, config, path):
+    """
+    Run the testing episode with the model and return its total reward and average queue length
+    """
+    from testing_simulation import Simulation
+    from generator import TrafficGenerator
+    from metrics import MetricsSink
+
+    os.makedirs(path, exist_ok=True)
+    Metrics = MetricsSink(path, buffer_size=config['metrics_buffer_size'])
+    simulation = Simulation(
+        model,
+        TrafficGenerator(config['max_steps'], config['n_cars_generated']),
+        Metrics,
+        set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps']),
+        config['max_steps'],
+        config['green_duration'],
+        config['yellow_duration'],
+        config['num_actions'],
+        config['state_channels']
+    )
+    simulation.run(config['episode_seed'])
+    Metrics.close()
+    return Metrics.stats('reward').sum, Metrics.stats('queue').mean
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    config = import_test_configuration(config_file=options.config)
+    model_path, _ = set_test_path(config['models_path_name'], config['model_to_test'])
+    student_path = os.path.join(model_path, 'student', '')
+    os.makedirs(student_path, exist_ok=True)
+    rng = np.random.RandomState(0)
+
+    teacher = TestModel(input_dim=config['num_states'], model_path=model_path)
+    states = load_states(model_path, rng)
+    n_test = max(1, len(states) // 10)  # held out states for the agreement, none of their perturbed copies is used for training
+    test_states, train_states = states[:n_test], states[n_test:]
+    augment = options.augment if is_binary(config['state_channels']) else 0  # cells can be flipped only in 0/1 states
+    train_states = augment_states(train_states, augment, rng)
+    teacher_q = teacher.predict_batch(train_states)
+
+    student = TrainModel(
+        options.layers,
+        options.width,
+        options.batch_size,
+        options.learning_rate,
+        input_dim=config['num_states'],
+        output_dim=config['num_actions']
+    )
+
+    # the student learns to reproduce the Q-values of the teacher
+    print("Distilling on", len(train_states), "states...")
+    for epoch in range(options.epochs):
+        order = rng.permutation(len(train_states))
+        for i in range(0, len(order), options.batch_size):
+            batch = order[i:i + options.batch_size]
+            student.train_batch(train_states[batch], teacher_q[batch])
+
+    student.save_model(student_path)
+    student = TestModel(input_dim=config['num_states'], model_path=student_path)
+
+    agreement = np.mean(np.argmax(student.predict_batch(test_states), axis=1) == np.argmax(teacher.predict_batch(test_states), axis=1))
+    latency_states = test_states[:200]
+    teacher_latency = measure_latency(teacher, latency_states)
+    student_latency = measure_latency(student, latency_states)
+
+    with open(os.path.join(student_path, 'distillation_report.txt'), "w") as file:
+        file.write("student: %d x %d, %d epochs on %d states\n" % (options.layers + 1, options.width, options.epochs, len(train_states)))
+        file.write("action agreement on %d held out states: %.4f\n" % (len(test_states), agreement))
+        file.write("latency per decision: teacher %.3f ms - student %.3f ms - speed-up %.1fx\n" % (teacher_latency, student_latency, teacher_latency / student_latency))
+        file.write("size: teacher %.1f kB - student %.1f kB\n" % (os.path.getsize(teacher.model_file) / 1024, os.path.getsize(student.model_file) / 1024))
+        if options.evaluate:
+            for name, model in [('teacher', teacher), ('student', student)]:
+                reward, queue = evaluate(model, config, os.path.join(student_path, 'test_' + name, ''))
+                file.write("%s evaluation: total reward %.1f - average queue length %.2f\n" % (name, reward, queue))
+
+    print("----- Student saved at:", student_path)
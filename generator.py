@@ -1,10 +1,84 @@
 import numpy as np
 import math
+import os
+import csv
+import bisect
+import xml.etree.ElementTree as ET
+
+# header of every route file: vehicle type and the routes of the 12 movements of the crossroads
+ROUTES_HEADER = """<routes>
+            <vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />
+
+            <route id="W_N" edges="WE2TrafficLight TrafficLight2North"/>
+            <route id="W_E" edges="WE2TrafficLight TrafficLight2East"/>
+            <route id="W_S" edges="WE2TrafficLight TrafficLight2South"/>
+            <route id="N_W" edges="North2TrafficLight TrafficLight2West"/>
+            <route id="N_E" edges="North2TrafficLight TrafficLight2East"/>
+            <route id="N_S" edges="North2TrafficLight TrafficLight2South"/>
+            <route id="E_W" edges="East2TrafficLight TrafficLight2West"/>
+            <route id="E_N" edges="East2TrafficLight TrafficLight2North"/>
+            <route id="E_S" edges="East2TrafficLight TrafficLight2South"/>
+            <route id="S_W" edges="South2TrafficLight TrafficLight2West"/>
+            <route id="S_N" edges="South2TrafficLight TrafficLight2North"/>
+            <route id="S_E" edges="South2TrafficLight TrafficLight2East"/>"""
+
+# edges of every movement, to map the from/to edges of the detector counts to a route id
+MOVEMENT_EDGES = {
+    ('WE2TrafficLight', 'TrafficLight2North'): 'W_N', ('WE2TrafficLight', 'TrafficLight2East'): 'W_E', ('WE2TrafficLight', 'TrafficLight2South'): 'W_S',
+    ('North2TrafficLight', 'TrafficLight2West'): 'N_W', ('North2TrafficLight', 'TrafficLight2East'): 'N_E', ('North2TrafficLight', 'TrafficLight2South'): 'N_S',
+    ('East2TrafficLight', 'TrafficLight2West'): 'E_W', ('East2TrafficLight', 'TrafficLight2North'): 'E_N', ('East2TrafficLight', 'TrafficLight2South'): 'E_S',
+    ('South2TrafficLight', 'TrafficLight2West'): 'S_W', ('South2TrafficLight', 'TrafficLight2North'): 'S_N', ('South2TrafficLight', 'TrafficLight2East'): 'S_E',
+}
+
+
+class DepartureGaps:
+    def __init__(self, min_gap=10):
+        self._min_gap = min_gap
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the departures of the previous episode
+        """
+        self._starts = []
+        self._ends = []
+        self._last = -math.inf
+
+    def add(self, depart):
+        """
+        Record a departure, the departures must be added in order, only the gaps between them are kept
+        gaps shorter than min_gap (one green interval) are not worth a jump and are dropped, so their number is
+        bounded by the episode length and not by the number of cars
+        """
+        if depart - self._last >= self._min_gap:
+            self._starts.append(self._last)
+            self._ends.append(depart)
+        self._last = max(self._last, depart)
+
+    def close(self):
+        """
+        After the last departure no other car is expected
+        """
+        self._starts.append(self._last)
+        self._ends.append(math.inf)
+
+    def next_departure(self, step):
+        """
+        Return the time of the first departure from the step, or the step itself if it is not inside a gap
+        a gap is open on both sides: at its start time a car departs, so the step must come after it
+        """
+        i = bisect.bisect_left(self._starts, step) - 1
+        if i >= 0 and step < self._ends[i]:
+            return self._ends[i]
+        return step
+
 
 class TrafficGenerator:
-    def __init__(self, max_steps, n_cars_generated):
+    def __init__(self, max_steps, n_cars_generated, route_file=os.path.join('intersection', 'routes.rou.xml'), min_gap=10):
         self._n_cars_generated = n_cars_generated  # how many cars per episode
         self._max_steps = max_steps
+        self._route_file = route_file  # a different file for each process, when more sessions run at the same time
+        self._gaps = DepartureGaps(min_gap)  # idle periods of the episode, shorter ones are simulated normally
 
     def generate_routefile(self, seed):
         """
@@ -27,23 +101,14 @@ class TrafficGenerator:
 
         car_gen_steps = np.rint(car_gen_steps)  # round every value to int -> effective steps when a car will be generated
 
-        # produce the file for cars generation, one car per line
-        with open("intersection/routes.rou.xml", "w") as routes:
-            print("""<routes>
-            <vType accel="1.0" decel="4.5" id="standard_car" length="5.0" minGap="2.5" maxSpeed="25" sigma="0.5" />
+        self._gaps.reset()
+        for step in car_gen_steps:
+            self._gaps.add(step)
+        self._gaps.close()
 
-            <route id="W_N" edges="WE2TrafficLight TrafficLight2North"/>
-            <route id="W_E" edges="WE2TrafficLight TrafficLight2East"/>
-            <route id="W_S" edges="WE2TrafficLight TrafficLight2South"/>
-            <route id="N_W" edges="North2TrafficLight TrafficLight2West"/>
-            <route id="N_E" edges="North2TrafficLight TrafficLight2East"/>
-            <route id="N_S" edges="North2TrafficLight TrafficLight2South"/>
-            <route id="E_W" edges="East2TrafficLight TrafficLight2West"/>
-            <route id="E_N" edges="East2TrafficLight TrafficLight2North"/>
-            <route id="E_S" edges="East2TrafficLight TrafficLight2South"/>
-            <route id="S_W" edges="South2TrafficLight TrafficLight2West"/>
-            <route id="S_N" edges="South2TrafficLight TrafficLight2North"/>
-            <route id="S_E" edges="South2TrafficLight TrafficLight2East"/>""", file=routes)
+        # produce the file for cars generation, one car per line
+        with open(self._route_file, "w") as routes:
+            print(ROUTES_HEADER, file=routes)
 
             for car_counter, step in enumerate(car_gen_steps):
                 straight_or_turn = np.random.uniform()
@@ -77,3 +142,131 @@ class TrafficGenerator:
                         print('    <vehicle id="S_E_%i" type="standard_car" route="S_E" depart="%s" departLane="random" departSpeed="10" />' % (car_counter, step), file=routes)
 
             print("</routes>", file=routes)
+
+
+    def next_departure(self, step):
+        """
+        Return the time of the first car departing from the step on (inf if no other car departs)
+        """
+        return self._gaps.next_departure(step)
+
+    @property
+    def max_steps(self):
+        return self._max_steps
+
+
+    @property
+    def n_cars_generated(self):
+        return self._n_cars_generated
+
+
+    @property
+    def scenario_id(self):
+        return '%d_%d' % (self._max_steps, self._n_cars_generated)
+
+
+class CountsTrafficGenerator:
+    def __init__(self, max_steps, counts_file, route_file=os.path.join('intersection', 'routes.rou.xml'), chunk_size=10000, min_gap=10):
+        self._max_steps = max_steps
+        self._counts_file = counts_file  # csv "begin,end,movement,count" or detector xml with <interval><edgeRelation from to count/>
+        self._route_file = route_file
+        self._chunk_size = chunk_size  # max number of vehicle lines buffered before writing
+        self._n_cars_generated = 0
+        self._gaps = DepartureGaps(min_gap)  # idle periods of the episode, shorter ones are simulated normally
+
+    def generate_routefile(self, seed):
+        """
+        Generation of the route of every car for one episode from per-interval, per-movement counts,
+        the counts are read and the vehicles written one interval at a time, so the memory does not depend on the scenario size
+        the intervals must be sorted by begin time and not overlap, so that the route file is sorted by departure
+        """
+        rng = np.random.RandomState(seed)  # make tests reproducible
+        self._n_cars_generated = 0
+        self._gaps.reset()
+
+        with open(self._route_file, "w") as routes:
+            print(ROUTES_HEADER, file=routes)
+            lines = []
+            for begin, end, movements in self._read_intervals():
+                if begin >= self._max_steps:
+                    break
+
+                # departures of the interval, uniformly distributed inside it and sorted
+                departures = []
+                for movement, count in movements:
+                    for depart in rng.uniform(begin, min(end, self._max_steps), count):
+                        departures.append((depart, movement))
+                departures.sort()
+
+                for depart, movement in departures:
+                    self._gaps.add(depart)
+                    lines.append('    <vehicle id="%s_%i" type="standard_car" route="%s" depart="%.2f" departLane="random" departSpeed="10" />\n' % (movement, self._n_cars_generated, movement, depart))
+                    self._n_cars_generated += 1
+                if len(lines) >= self._chunk_size:
+                    routes.writelines(lines)
+                    lines = []
+
+            routes.writelines(lines)
+            print("</routes>", file=routes)
+        self._gaps.close()
+
+    def _read_intervals(self):
+        """
+        Stream the counts file, yielding the (movement, count) pairs of one interval at a time
+        """
+        if self._counts_file.endswith('.xml'):
+            rows = self._read_detector_rows()
+        else:
+            rows = self._read_csv_rows()
+
+        current = None
+        movements = []
+        for begin, end, movement, count in rows:
+            if current is not None and (begin, end) != current:
+                yield current[0], current[1], movements
+                movements = []
+            current = (begin, end)
+            if count > 0:
+                movements.append((movement, count))
+        if current is not None:
+            yield current[0], current[1], movements
+
+    def _read_csv_rows(self):
+        """
+        Read the rows of a csv file with the columns begin, end, movement (route id, e.g. W_E), count
+        """
+        with open(self._counts_file, "r", newline='') as file:
+            for row in csv.DictReader(file):
+                yield float(row['begin']), float(row['end']), row['movement'], int(row['count'])
+
+    def _read_detector_rows(self):
+        """
+        Read the edge relation counts of a detector output file, clearing every interval once read
+        """
+        for _, element in ET.iterparse(self._counts_file, events=('end',)):
+            if element.tag != 'interval':
+                continue
+            begin, end = float(element.get('begin')), float(element.get('end'))
+            for relation in element.iter('edgeRelation'):
+                movement = MOVEMENT_EDGES.get((relation.get('from'), relation.get('to')))
+                if movement is not None:
+                    yield begin, end, movement, int(float(relation.get('count', 0)))
+            element.clear()
+
+    def next_departure(self, step):
+        """
+        Return the time of the first car departing from the step on (inf if no other car departs)
+        """
+        return self._gaps.next_departure(step)
+
+    @property
+    def max_steps(self):
+        return self._max_steps
+
+    @property
+    def n_cars_generated(self):
+        return self._n_cars_generated
+
+    @property
+    def scenario_id(self):
+        return '%d_%s_%d' % (self._max_steps, os.path.splitext(os.path.basename(self._counts_file))[0], os.path.getsize(self._counts_file))
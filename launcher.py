@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import subprocess
+import configparser
+import timeit
+
+from utils import import_resources_configuration, parse_cores, get_available_cores
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--script", default="runner.py",
+                         help="script run by every job: runner.py or testing_main.py")
+    optParser.add_option("--config", default="training_settings.ini",
+                         help="settings file of the jobs, its [resources] section defines the core budget")
+    options, args = optParser.parse_args()
+    return options
+
+
+def split_budget(core_budget, parallel_jobs, sumo_cores_per_job):
+    """
+    Split the core budget in equal slices, one per job: the first cores of each slice run sumo, the others the learner
+    """
+    cores = parse_cores(core_budget) if core_budget else get_available_cores()
+    per_job = len(cores) // parallel_jobs
+    if per_job < sumo_cores_per_job + 1:
+        sys.exit("The core budget (%d cores) is too small for %d jobs with %d sumo cores each" % (len(cores), parallel_jobs, sumo_cores_per_job))
+
+    jobs = []
+    for n in range(parallel_jobs):
+        job_cores = cores[n * per_job:(n + 1) * per_job]
+        sumo_cores = ','.join(str(core) for core in job_cores[:sumo_cores_per_job])
+        learner_cores = ','.join(str(core) for core in job_cores[sumo_cores_per_job:])
+        jobs.append((sumo_cores, learner_cores))
+    return jobs, len(cores)
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    content = configparser.ConfigParser()
+    content.read(options.config)
+    resources = import_resources_configuration(content)
+    jobs, budget = split_budget(resources['core_budget'], resources['parallel_jobs'], resources['sumo_cores_per_job'])
+    episodes_per_job = content.getint('simulation', 'total_episodes', fallback=1)  # the testing settings have a single episode
+
+    start_time = timeit.default_timer()
+    processes = []
+    for n, (sumo_cores, learner_cores) in enumerate(jobs):
+        route_file = os.path.join('intersection', 'routes_job_%d.rou.xml' % n)
+        cmd = [sys.executable, options.script, '--config', options.config, '--route-file', route_file,
+               '--sumo-cores', sumo_cores, '--learner-cores', learner_cores]
+        if options.script == 'testing_main.py':
+            cmd += ['--test-folder', 'test_job_%d' % n]  # the jobs test the same model, each one saves in its own folder
+        log = open('launcher_job_%d.txt' % n, "w")
+        processes.append((subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT), log))
+        print("Job", n, "- sumo cores:", sumo_cores, "- learner cores:", learner_cores)
+
+    failed = 0
+    for process, log in processes:
+        if process.wait() != 0:
+            failed += 1
+        log.close()
+    wall_time = timeit.default_timer() - start_time
+
+    episodes = episodes_per_job * (len(jobs) - failed)
+    episodes_per_hour = episodes / wall_time * 3600
+    print("\n----- Jobs done:", len(jobs) - failed, "of", len(jobs), "- wall time:", round(wall_time, 1), "s")
+    print("----- Throughput:", round(episodes_per_hour, 2), "episodes/hour on a budget of", budget, "cores",
+          "(", round(episodes_per_hour / budget, 2), "episodes/hour per core )")
@@ -1,36 +1,147 @@
+import os
+import json
 import random
+import numpy as np
 
 class Memory:
-    def __init__(self, size_max, size_min):
-        self._samples = []
+    def __init__(self, size_max, size_min, num_states, packed=True):
         self._size_max = size_max
         self._size_min = size_min
+        self._num_states = num_states
+        self._packed = packed
+
+        # preallocated ring buffer, the 0/1 occupancy states are stored bit-packed (8 cells per byte), the others as float32
+        if packed:
+            state_shape, state_type = (num_states + 7) // 8, np.uint8
+        else:
+            state_shape, state_type = num_states, np.float32
+        self._states = np.zeros((size_max, state_shape), dtype=state_type)
+        self._actions = np.zeros(size_max, dtype=np.uint8)
+        self._rewards = np.zeros(size_max, dtype=np.float32)
+        self._next_states = np.zeros((size_max, state_shape), dtype=state_type)
+        self._max_q_next = np.zeros(size_max, dtype=np.float32)  # max Q(next_state) of the target network, cached per transition
+        self._max_q_valid = np.zeros(size_max, dtype=bool)
+        self._next_index = 0  # where the next sample is written
+        self._size = 0
 
 
     def add_sample(self, sample):
         """
         Add a sample into the memory
         """
-        self._samples.append(sample)
-        if self._size_now() > self._size_max:
-            self._samples.pop(0)  # if the length is greater than the size of memory, remove the oldest element
+        state, action, reward, next_state = sample
+        i = self._next_index
+        self._states[i] = self._pack(state)
+        self._actions[i] = action
+        self._rewards[i] = reward
+        self._next_states[i] = self._pack(next_state)
+        self._max_q_valid[i] = False
+
+        self._next_index = (i + 1) % self._size_max  # if the memory is full, the oldest element is overwritten
+        self._size = min(self._size + 1, self._size_max)
+
+
+    def clear(self):
+        """
+        Empty the memory, keeping its buffers allocated
+        """
+        self._next_index = 0
+        self._size = 0
+        self._max_q_valid[:] = False
 
 
     def get_samples(self, n):
         """
-        Get n samples randomly from the memory
+        Get n samples randomly from the memory, as arrays of states, actions, rewards and next states
         """
-        if self._size_now() < self._size_min:
-            return []
+        indexes = self._sample_indexes(n)
+        return self._unpack(self._states[indexes]), self._actions[indexes], self._rewards[indexes], self._unpack(self._next_states[indexes])
+
+
+    def get_states(self, n):
+        """
+        Get up to n stored states randomly, also when the memory is not full enough for the training
+        """
+        indexes = random.sample(range(self._size_now()), min(n, self._size_now()))
+        return self._unpack(self._states[indexes])
+
+
+    def get_samples_with_targets(self, n, predict_target):
+        """
+        Get n samples randomly from the memory, with the cached max Q(next_state) instead of the next states
+        the values missing from the cache (transitions added after the last update) are computed with predict_target
+        """
+        indexes = np.array(self._sample_indexes(n), dtype=np.int64)
+        missing = indexes[~self._max_q_valid[indexes]]
+        if len(missing) > 0:
+            self._max_q_next[missing] = np.amax(predict_target(self._unpack(self._next_states[missing])), axis=1)
+            self._max_q_valid[missing] = True
+        return self._unpack(self._states[indexes]), self._actions[indexes], self._rewards[indexes], self._max_q_next[indexes]
+
+
+    def update_targets(self, predict_target, chunk_size=4096):
+        """
+        Recompute in bulk the max Q(next_state) of every stored transition, to be called after the target network is synced
+        """
+        for start in range(0, self._size_now(), chunk_size):
+            end = min(start + chunk_size, self._size_now())
+            self._max_q_next[start:end] = np.amax(predict_target(self._unpack(self._next_states[start:end])), axis=1)
+        self._max_q_valid[:self._size_now()] = True
 
-        if n > self._size_now():
-            return random.sample(self._samples, self._size_now())  # get all the samples
+
+    def export(self, path):
+        """
+        Save the stored transitions, oldest first, as a columnar dataset: one .npy file per field, states in their stored form
+        """
+        os.makedirs(path, exist_ok=True)
+        indexes = (self._next_index - self._size + np.arange(self._size)) % self._size_max
+        for name, column in [('states', self._states), ('actions', self._actions), ('rewards', self._rewards), ('next_states', self._next_states)]:
+            np.save(os.path.join(path, name + '.npy'), column[indexes])
+        with open(os.path.join(path, 'dataset.json'), "w") as file:
+            json.dump({'size': self._size, 'num_states': self._num_states, 'packed': self._packed}, file)
+
+
+    def _sample_indexes(self, n):
+        """
+        Choose the indexes of n random samples, none if the memory is not full enough
+        """
+        if not self.is_full_enough():
+            return []
+        elif n > self._size_now():
+            indexes = list(range(self._size_now()))  # get all the samples
+            random.shuffle(indexes)
+            return indexes
         else:
-            return random.sample(self._samples, n)  # get "batch size" number of samples
+            return random.sample(range(self._size_now()), n)  # get "batch size" number of samples
+
+
+    def is_full_enough(self):
+        """
+        Check if the memory holds enough samples to start the training
+        """
+        return self._size_now() >= self._size_min
+
+
+    def _pack(self, state):
+        """
+        Convert a state to its stored form
+        """
+        if self._packed:
+            return np.packbits(np.asarray(state) > 0)
+        return state
+
+
+    def _unpack(self, packed_states):
+        """
+        Unpack a batch of bit-packed states in a single vectorized step
+        """
+        if self._packed:
+            return np.unpackbits(packed_states, axis=1)[:, :self._num_states].astype(np.float32)
+        return packed_states
 
 
     def _size_now(self):
         """
         Check how full the memory is
         """
-        return len(self._samples)
\ No newline at end of file
+        return self._size
@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import json
+import random
+import optparse
+import numpy as np
+
+from utils import import_train_configuration, import_test_configuration, set_sumo, set_train_path, set_test_path
+from registry import get_run_id
+import runner
+import testing_main
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--config", default="training_settings.ini",
+                         help="training settings file, the same session is run with and without the mesoscopic episodes")
+    optParser.add_option("--test-config", dest="test_config", default="testing_settings.ini",
+                         help="testing settings file, it defines the microscopic evaluation episode of both models")
+    optParser.add_option("--meso-episodes", dest="meso_episodes", type="int", default=None,
+                         help="mesoscopic episodes at the start of the schedule, overrides the settings file")
+    optParser.add_option("--seed", type="int", default=0, help="seed of both sessions")
+    options, args = optParser.parse_args()
+    return options
+
+
+def run_schedule(config, config_file, test_config, test_config_file, seed):
+    """
+    Train a model with the schedule of the config, then evaluate it on the microscopic testing episode
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    import tensorflow as tf
+    tf.random.set_seed(seed)
+
+    route_file = os.path.join('intersection', 'routes.rou.xml')
+    path = set_train_path(config['models_path_name'])
+    timings = runner.train_session(config, config_file, path, route_file, set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], route_file),
+                                   runner.build_model(config), runner.build_memory(config))
+
+    test_config = dict(test_config, model_to_test=get_run_id(path), models_path_name=config['models_path_name'])
+    model_path, plot_path = set_test_path(test_config['models_path_name'], test_config['model_to_test'])
+    testing_main.test_session(test_config, test_config_file, plot_path, route_file,
+                              set_sumo(test_config['gui'], test_config['sumocfg_file_name'], test_config['max_steps'], route_file),
+                              testing_main.build_model(test_config, model_path))
+
+    # same metrics as the summary saved by the testing session
+    with open(os.path.join(plot_path, 'plot_reward_data.txt')) as file:
+        reward = sum(float(line) for line in file)
+    with open(os.path.join(plot_path, 'plot_queue_data.txt')) as file:
+        queues = [float(line) for line in file]
+    return path, timings, {'test_reward': reward, 'test_queue': sum(queues) / max(len(queues), 1)}
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    config = import_train_configuration(config_file=options.config)
+    test_config = import_test_configuration(config_file=options.test_config)
+    if options.meso_episodes is not None:
+        config['meso_episodes'] = options.meso_episodes
+    if not 0 < config['meso_episodes'] < config['total_episodes']:
+        sys.exit("meso_episodes must be between 1 and total_episodes - 1 to compare the schedules")
+
+    results = {}
+    for name, meso_episodes in [('meso', config['meso_episodes']), ('micro', 0)]:
+        print("\n----- Schedule:", name, "-", meso_episodes, "mesoscopic episodes of", config['total_episodes'])
+        path, timings, evaluation = run_schedule(dict(config, meso_episodes=meso_episodes), options.config, test_config, options.test_config, options.seed)
+        results[name] = dict(path=path, timings=timings, **evaluation)
+
+    meso, micro = results['meso'], results['micro']
+    results['speedup_total'] = round(micro['timings']['total'] / meso['timings']['total'], 2)
+    results['speedup_simulation'] = round(micro['timings']['simulation'] / meso['timings']['simulation'], 2)
+    with open(os.path.join(meso['path'], 'meso_comparison.json'), "w") as file:
+        json.dump(results, file, indent=4)
+
+    print("\n----- Mesoscopic pre-training vs all microscopic")
+    print("speed-up: total", results['speedup_total'], "x - simulation", results['speedup_simulation'], "x")
+    for name in ['meso', 'micro']:
+        print(name, "- test reward:", round(results[name]['test_reward'], 1), "- test average queue length:", round(results[name]['test_queue'], 2))
+    print("----- Comparison saved at:", os.path.join(meso['path'], 'meso_comparison.json'))
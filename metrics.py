@@ -0,0 +1,147 @@
+import math
+import os
+
+
+class RunningStats:
+    def __init__(self):
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+        self._last = None
+
+
+    def update(self, value):
+        """
+        Update the statistics with a new value, without storing it (Welford's online algorithm)
+        """
+        self._count += 1
+        self._last = value
+        self._sum += value
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+
+    @property
+    def count(self):
+        return self._count
+
+
+    @property
+    def sum(self):
+        return self._sum
+
+
+    @property
+    def mean(self):
+        return self._mean
+
+
+    @property
+    def std(self):
+        if self._count < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self._count - 1))
+
+
+    @property
+    def last(self):
+        return self._last
+
+
+    @property
+    def min(self):
+        return self._min
+
+
+    @property
+    def max(self):
+        return self._max
+
+
+class MetricsSink:
+    def __init__(self, path, buffer_size=1000):
+        self._path = path
+        self._buffer_size = buffer_size
+        self._buffers = {}
+        self._stats = {}
+        self._started = set()
+
+
+    def append(self, name, value):
+        """
+        Record a value of the metric 'name', the value is written to disk when the buffer of the metric is full
+        """
+        if name not in self._buffers:
+            self._buffers[name] = []
+            self._stats[name] = RunningStats()
+        self._buffers[name].append(value)
+        self._stats[name].update(value)
+        if len(self._buffers[name]) >= self._buffer_size:
+            self._flush_one(name)
+
+
+    def flush(self):
+        """
+        Write to disk every buffered value, so that the files can be monitored while the session is running
+        """
+        for name in self._buffers:
+            self._flush_one(name)
+
+
+    def close(self):
+        """
+        Flush the remaining values and save the summary statistics of every metric
+        """
+        self.flush()
+        with open(os.path.join(self._path, 'metrics_summary.txt'), "w") as file:
+            file.write("metric count sum mean std min max\n")
+            for name, stats in self._stats.items():
+                file.write("%s %d %s %s %s %s %s\n" % (name, stats.count, stats.sum, stats.mean, stats.std, stats.min, stats.max))
+
+
+    def _flush_one(self, name):
+        """
+        Append the buffered values of a metric to its data file, one value per line (same format as plot_*_data.txt)
+        """
+        buffer = self._buffers[name]
+        if not buffer and name in self._started:
+            return
+
+        mode = "a" if name in self._started else "w"  # the first write of the session overwrites old data
+        with open(self.data_file(name), mode) as file:
+            file.writelines("%s\n" % value for value in buffer)
+        self._started.add(name)
+        buffer.clear()
+
+
+    def data_file(self, name):
+        """
+        Return the path of the data file of the metric 'name'
+        """
+        return os.path.join(self._path, 'plot_' + name + '_data.txt')
+
+
+    def stats(self, name):
+        """
+        Return the online summary statistics of the metric 'name'
+        """
+        return self._stats[name]
+
+
+    def summary(self):
+        """
+        Return the last and mean value of every metric, e.g. to be saved in the run registry
+        """
+        summary = {}
+        for name, stats in self._stats.items():
+            summary['final_' + name] = stats.last
+            summary['mean_' + name] = stats.mean
+        return summary
@@ -3,6 +3,8 @@ os.environ['TF_CPP_MIN_LOG_LEVEL']='2'  # kill warning about tensorflow
 import tensorflow as tf
 import numpy as np
 import sys
+import timeit
+from collections import OrderedDict
 
 from tensorflow import keras
 from tensorflow.keras import layers
@@ -12,13 +14,80 @@ from tensorflow.keras.utils import plot_model
 from tensorflow.keras.models import load_model
 
 
+class PredictionCache:
+    def __init__(self, size_max):
+        self._size_max = size_max
+        self._entries = OrderedDict()  # packed state -> action values, in least recently used order
+        self.reset_stats()
+
+
+    def predict(self, state, predict_fn):
+        """
+        Return the cached action values of the state if present, otherwise compute them with predict_fn and cache them
+        """
+        start_time = timeit.default_timer()
+        if self._size_max <= 0:
+            return predict_fn(state)
+
+        state = np.asarray(state)
+        if np.all((state == 0) | (state == 1)):
+            key = np.packbits(state > 0).tobytes()  # the 80 occupancy cells fit in 10 bytes
+        else:
+            key = state.astype(np.float32).tobytes()  # states with speed or waiting time channels
+        q_values = self._entries.get(key)
+        if q_values is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            self._hit_time += timeit.default_timer() - start_time
+        else:
+            q_values = predict_fn(state)
+            self._entries[key] = q_values
+            if len(self._entries) > self._size_max:
+                self._entries.popitem(last=False)  # remove the least recently used state
+            self._misses += 1
+            self._miss_time += timeit.default_timer() - start_time
+        return q_values
+
+
+    def clear(self):
+        """
+        Invalidate every cached value, to be called whenever the weights of the model change
+        """
+        self._entries.clear()
+
+
+    def reset_stats(self):
+        """
+        Reset the counters of hits, misses and their latency
+        """
+        self._hits = 0
+        self._misses = 0
+        self._hit_time = 0
+        self._miss_time = 0
+
+
+    def report(self):
+        """
+        Return a summary of hit rate and latency of the cache
+        """
+        lookups = self._hits + self._misses
+        if lookups == 0:
+            return "no lookups"
+        hit_ms = self._hit_time / self._hits * 1000 if self._hits else 0
+        miss_ms = self._miss_time / self._misses * 1000 if self._misses else 0
+        return "hit rate %.1f%% (%d/%d) - hit latency %.3f ms - miss latency %.3f ms" % (100 * self._hits / lookups, self._hits, lookups, hit_ms, miss_ms)
+
+
 class TrainModel:
-    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim):
+    def __init__(self, num_layers, width, batch_size, learning_rate, input_dim, output_dim, cache_size=0):
         self._input_dim = input_dim
         self._output_dim = output_dim
         self._batch_size = batch_size
         self._learning_rate = learning_rate
         self._model = self._build_model(num_layers, width)
+        self._initial_weights = self._model.get_weights()
+        self._target_model = None  # frozen copy used to compute the targets of the replay, built at the first sync
+        self._cache = PredictionCache(cache_size)
 
 
     def _build_model(self, num_layers, width):
@@ -38,7 +107,14 @@ class TrainModel:
 
     def predict_one(self, state):
         """
-        Predict the action values from a single state
+        Predict the action values from a single state, reusing the cached values if the state was already seen
+        """
+        return self._cache.predict(state, self._predict_one)
+
+
+    def _predict_one(self, state):
+        """
+        Run the nn on a single state
         """
         state = np.reshape(state, [1, self._input_dim])
         return self._model.predict(state)
@@ -51,19 +127,105 @@ class TrainModel:
         return self._model.predict(states)
 
 
+    def predict_target(self, states):
+        """
+        Predict the action values from a batch of states with the target network
+        """
+        return self._target_model.predict(states, batch_size=1024)
+
+
+    def sync_target(self):
+        """
+        Copy the current weights into the target network
+        """
+        if self._target_model is None:
+            self._target_model = keras.models.clone_model(self._model)
+        self._target_model.set_weights(self._model.get_weights())
+
+
+    def reset(self):
+        """
+        Bring the model back to its initial weights and optimizer state, so that it can be reused by a new session without rebuilding it
+        """
+        self._model.set_weights(self._initial_weights)
+        # the target network, if built, is overwritten by the first sync of the next session
+        for variable in self._model.optimizer.variables():
+            variable.assign(tf.zeros_like(variable))
+        self._cache.clear()
+        self._cache.reset_stats()
+
+
     def train_batch(self, states, q_sa):
         """
         Train the nn using the updated q-values
         """
         self._model.fit(states, q_sa, epochs=1, verbose=0)
+        self._cache.clear()  # the cached action values are stale with the new weights
 
 
-    def save_model(self, path):
+    def save_model(self, path, export_precisions=(), calibration_states=None):
         """
-        Save the current model in the folder as h5 file and a model architecture summary as png
+        Save the current model in the folder as h5 file and a model architecture summary as png,
+        optionally exporting also reduced precision versions (float16, int8) of the model for faster inference
+        the states recorded during the episodes are saved too, they are reused for calibration and distillation
         """
         self._model.save(os.path.join(path, 'trained_model.h5'))
         plot_model(self._model, to_file=os.path.join(path, 'model_structure.png'), show_shapes=True, show_layer_names=True)
+        has_states = calibration_states is not None and len(calibration_states) > 0
+        if has_states:
+            np.save(os.path.join(path, 'recorded_states.npy'), np.asarray(calibration_states, dtype=np.float32))
+
+        if 'int8' in export_precisions and not has_states:  # float16 needs no calibration, it is still exported
+            print("Warning: no recorded states to calibrate the int8 model, it is not exported")
+            export_precisions = [precision for precision in export_precisions if precision != 'int8']
+        for precision in export_precisions:
+            self._export_model(path, precision, calibration_states)
+        if export_precisions and has_states:  # the comparison runs on the recorded states
+            self._save_export_report(path, export_precisions, calibration_states)
+
+
+    def _export_model(self, path, precision, calibration_states):
+        """
+        Convert the model to tflite with float16 weights or with int8 quantization calibrated on the states recorded from the episodes
+        """
+        converter = tf.lite.TFLiteConverter.from_keras_model(self._model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if precision == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif precision == 'int8':
+            def representative_dataset():
+                for state in calibration_states:
+                    yield [np.reshape(state, [1, self._input_dim]).astype(np.float32)]
+            converter.representative_dataset = representative_dataset
+        else:
+            sys.exit("Precision '%s' not supported, use float16 or int8" % precision)
+
+        with open(os.path.join(path, 'trained_model_' + precision + '.tflite'), "wb") as file:
+            file.write(converter.convert())
+
+
+    def _save_export_report(self, path, export_precisions, calibration_states):
+        """
+        Compare the exported models with the float32 one: agreement of the chosen actions, latency per decision and file size
+        """
+        states = np.asarray(calibration_states, dtype=np.float32)
+        reference = TestModel(self._input_dim, path)
+        models = [('float32', reference)] + [(precision, TestModel(self._input_dim, path, precision)) for precision in export_precisions]
+        reference_actions = np.argmax(reference.predict_batch(states), axis=1)
+
+        with open(os.path.join(path, 'export_report.txt'), "w") as file:
+            file.write("precision action_agreement latency_ms size_kb\n")
+            for precision, model in models:
+                actions = np.argmax(model.predict_batch(states), axis=1)
+                agreement = np.mean(actions == reference_actions)
+
+                start_time = timeit.default_timer()
+                for state in states:
+                    model.predict_one(state)
+                latency = (timeit.default_timer() - start_time) / len(states) * 1000
+
+                size = os.path.getsize(model.model_file) / 1024
+                file.write("%s %.4f %.3f %.1f\n" % (precision, agreement, latency, size))
 
 
     @property
@@ -81,33 +243,96 @@ class TrainModel:
         return self._batch_size
 
 
+    @property
+    def cache(self):
+        return self._cache
+
+
 class TestModel:
-    def __init__(self, input_dim, model_path):
+    def __init__(self, input_dim, model_path, precision='float32', cache_size=0):
         self._input_dim = input_dim
+        self._precision = precision
         self._model = self._load_my_model(model_path)
+        self._cache = PredictionCache(cache_size)
 
 
     def _load_my_model(self, model_folder_path):
         """
         Load the model stored in the folder specified by the model number, if it exists
+        the float32 model is the keras h5 file, the reduced precision ones are tflite files exported by TrainModel
         """
-        model_file_path = os.path.join(model_folder_path, 'trained_model.h5')
-        
-        if os.path.isfile(model_file_path):
-            loaded_model = load_model(model_file_path)
-            return loaded_model
+        if self._precision == 'float32':
+            self._model_file = os.path.join(model_folder_path, 'trained_model.h5')
         else:
+            self._model_file = os.path.join(model_folder_path, 'trained_model_' + self._precision + '.tflite')
+
+        if not os.path.isfile(self._model_file):
             sys.exit("Model number not found")
 
+        if self._precision == 'float32':
+            return load_model(self._model_file)
+
+        interpreter = tf.lite.Interpreter(model_path=self._model_file)
+        interpreter.allocate_tensors()
+        self._input_details = interpreter.get_input_details()[0]
+        self._output_details = interpreter.get_output_details()[0]
+        return interpreter
+
 
     def predict_one(self, state):
         """
-        Predict the action values from a single state
+        Predict the action values from a single state, reusing the cached values if the state was already seen
+        """
+        return self._cache.predict(state, self._predict_one)
+
+
+    def _predict_one(self, state):
+        """
+        Run the model on a single state
         """
         state = np.reshape(state, [1, self._input_dim])
-        return self._model.predict(state)
+        if self._precision == 'float32':
+            return self._model.predict(state)
+        return self._invoke(state)
+
+
+    def predict_batch(self, states):
+        """
+        Predict the action values from a batch of states
+        """
+        if self._precision == 'float32':
+            return self._model.predict(states)
+        return np.concatenate([self._invoke(np.reshape(state, [1, self._input_dim])) for state in states])
+
+
+    def _invoke(self, state):
+        """
+        Run the tflite interpreter on a single state, (de)quantizing input and output if the model works on integers
+        """
+        input_type = self._input_details['dtype']
+        if input_type in (np.int8, np.uint8):
+            scale, zero_point = self._input_details['quantization']
+            state = np.round(state / scale + zero_point)
+        self._model.set_tensor(self._input_details['index'], state.astype(input_type))
+        self._model.invoke()
+
+        q_values = self._model.get_tensor(self._output_details['index'])
+        if self._output_details['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self._output_details['quantization']
+            q_values = (q_values.astype(np.float32) - zero_point) * scale
+        return q_values
+
+
+    @property
+    def model_file(self):
+        return self._model_file
 
 
     @property
     def input_dim(self):
-        return self._input_dim
\ No newline at end of file
+        return self._input_dim
+
+
+    @property
+    def cache(self):
+        return self._cache
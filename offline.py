@@ -0,0 +1,163 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import json
+import queue
+import optparse
+import threading
+import timeit
+import numpy as np
+from shutil import copyfile
+
+from model import TrainModel
+from utils import import_train_configuration, set_train_path, set_resources
+from registry import RunRegistry, get_run_id
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="usage: %prog [options] dataset")
+    optParser.add_option("--config", default="training_settings.ini",
+                         help="training settings file, it defines the model, the batch size, gamma and the target network interval")
+    optParser.add_option("--epochs", type="int", default=10, help="passes over the dataset")
+    optParser.add_option("--chunk-batches", dest="chunk_batches", type="int", default=64,
+                         help="batches read from disk at once, the transitions are shuffled inside each chunk")
+    optParser.add_option("--prefetch", type="int", default=8, help="batches prepared in advance while the model trains")
+    optParser.add_option("--seed", type="int", default=0, help="seed of the shuffling")
+    options, args = optParser.parse_args()
+    if len(args) != 1:
+        optParser.error("the dataset is required, e.g. models/model_12/transitions")
+    return options, args[0]
+
+
+class TransitionDataset:
+    def __init__(self, path):
+        with open(os.path.join(path, 'dataset.json')) as file:
+            info = json.load(file)
+        self._size = info['size']
+        self._num_states = info['num_states']
+        self._packed = info['packed']
+        # memory mapped columns, only the chunks being used are read from disk
+        self._states = np.load(os.path.join(path, 'states.npy'), mmap_mode='r')
+        self._actions = np.load(os.path.join(path, 'actions.npy'), mmap_mode='r')
+        self._rewards = np.load(os.path.join(path, 'rewards.npy'), mmap_mode='r')
+        self._next_states = np.load(os.path.join(path, 'next_states.npy'), mmap_mode='r')
+
+
+    def batches(self, batch_size, chunk_size, rng):
+        """
+        Yield the batches of one pass over the dataset, reading one contiguous chunk at a time in random order
+        """
+        starts = np.arange(0, self._size, chunk_size)
+        rng.shuffle(starts)
+        for start in starts:
+            end = min(start + chunk_size, self._size)
+            order = rng.permutation(end - start)
+            states = self._unpack(self._states[start:end])[order]
+            actions = np.asarray(self._actions[start:end])[order]
+            rewards = np.asarray(self._rewards[start:end])[order]
+            next_states = self._unpack(self._next_states[start:end])[order]
+            for i in range(0, end - start, batch_size):
+                yield states[i:i + batch_size], actions[i:i + batch_size], rewards[i:i + batch_size], next_states[i:i + batch_size]
+
+
+    def _unpack(self, stored_states):
+        """
+        Convert a chunk of stored states to the input of the model, same format as Memory
+        """
+        if self._packed:
+            return np.unpackbits(stored_states, axis=1)[:, :self._num_states].astype(np.float32)
+        return np.asarray(stored_states, dtype=np.float32)
+
+
+    @property
+    def size(self):
+        return self._size
+
+
+    @property
+    def num_states(self):
+        return self._num_states
+
+
+def prefetch(batches, size):
+    """
+    Read the batches in a background thread, keeping up to 'size' of them ready for the training loop
+    """
+    ready = queue.Queue(maxsize=size)
+    end = object()
+
+    def produce():
+        for batch in batches:
+            ready.put(batch)
+        ready.put(end)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = ready.get()
+        if batch is end:
+            return
+        yield batch
+
+
+def train_offline(Model, Dataset, gamma, target_update_interval, epochs, chunk_size, prefetch_size, rng):
+    """
+    Train the model with the Q-learning update of the replay on every transition of the dataset, return the number of batches
+    """
+    batch_count = 0
+    for epoch in range(epochs):
+        batches = Dataset.batches(Model.batch_size, chunk_size, rng)
+        for states, actions, rewards, next_states in prefetch(batches, prefetch_size):
+            if target_update_interval > 0:
+                if batch_count % target_update_interval == 0:
+                    Model.sync_target()
+                q_s_a_d = Model.predict_target(next_states)
+            else:
+                q_s_a_d = Model.predict_batch(next_states)
+            q_s_a = Model.predict_batch(states)
+            q_s_a[np.arange(len(states)), actions] = rewards + gamma * np.amax(q_s_a_d, axis=1)
+            Model.train_batch(states, q_s_a)
+            batch_count += 1
+        print("Epoch", epoch + 1, "of", epochs, "-", batch_count, "batches")
+    return batch_count
+
+
+if __name__ == "__main__":
+
+    options, dataset_path = get_options()
+    config = import_train_configuration(config_file=options.config)
+    Dataset = TransitionDataset(dataset_path)
+    if Dataset.num_states != config['num_states']:
+        sys.exit("The dataset has %d state cells, the settings file %d" % (Dataset.num_states, config['num_states']))
+    set_resources(config['learner_cores'], config['intra_op_threads'], config['inter_op_threads'])
+    path = set_train_path(config['models_path_name'])
+
+    Model = TrainModel(
+        config['num_layers'],
+        config['width_layers'],
+        config['batch_size'],
+        config['learning_rate'],
+        input_dim=config['num_states'],
+        output_dim=config['num_actions']
+    )
+
+    print("Training on", Dataset.size, "transitions of", dataset_path)
+    start_time = timeit.default_timer()
+    batch_count = train_offline(Model, Dataset, config['gamma'], config['target_update_interval'], options.epochs,
+                                options.chunk_batches * config['batch_size'], options.prefetch, np.random.RandomState(options.seed))
+    training_time = round(timeit.default_timer() - start_time, 1)
+
+    calibration_states = next(Dataset.batches(config['calibration_states'], config['calibration_states'], np.random.RandomState(options.seed)))[0]
+    Model.save_model(path, config['export_precisions'], calibration_states)
+    copyfile(src=options.config, dst=os.path.join(path, 'training_settings.ini'))
+
+    with open(os.path.join(path, 'offline_report.txt'), "w") as file:
+        file.write("dataset: %s (%d transitions)\n" % (os.path.abspath(dataset_path), Dataset.size))
+        file.write("%d epochs - %d batches in %.1f s - %.1f batches/s\n" % (options.epochs, batch_count, training_time, batch_count / max(training_time, 0.1)))
+
+    settings = dict(config, offline_dataset=os.path.abspath(dataset_path), offline_epochs=options.epochs)
+    timings = {'simulation': 0, 'training': training_time, 'total': training_time, 'episodes': 0, 'decisions': 0, 'batches': batch_count}
+    RunRegistry(os.path.join(os.getcwd(), config['models_path_name'])).record_run(get_run_id(path), settings, timings, {})
+
+    print("----- Offline model saved at:", path)
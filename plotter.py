@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import glob
+import optparse
+
+from visualization import Visualization
+
+
+# axis labels of the data files saved by the training session and by the testing session
+TRAIN_LABELS = {
+    'reward': ('Episode', 'Cumulative negative reward'),
+    'delay': ('Episode', 'Cumulative delay (s)'),
+    'queue': ('Episode', 'Average queue length (vehicles)'),
+    'avg_speed': ('Episode', 'Average speed (m/s)'),
+}
+
+TEST_LABELS = {
+    'reward': ('Action step', 'Reward'),
+    'queue': ('Step', 'Queue lenght (vehicles)'),
+}
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="usage: %prog [options] [folder ...]")
+    optParser.add_option("--all", action="store_true", default=False,
+                         help="regenerate the plots of every model folder (and its test folder) in the models folder")
+    optParser.add_option("--models-path", dest="models_path", default="models",
+                         help="folder containing the model_N folders, used with --all")
+    optParser.add_option("--dpi", type="int", default=96, help="resolution of the saved plots")
+    optParser.add_option("--force", action="store_true", default=False,
+                         help="render also the plots that are already up to date with their data file")
+    options, args = optParser.parse_args()
+    return options, args
+
+
+def plot_folder(path, dpi, force=False):
+    """
+    Render a plot for every plot_*_data.txt file of the folder, skipping the ones whose png is newer than the data
+    """
+    labels = TEST_LABELS if os.path.basename(os.path.normpath(path)) == 'test' else TRAIN_LABELS
+    visualization = Visualization(path, dpi=dpi)
+    rendered = 0
+
+    for data_file in sorted(glob.glob(os.path.join(path, 'plot_*_data.txt'))):
+        filename = os.path.basename(data_file)[len('plot_'):-len('_data.txt')]
+        plot_file = os.path.join(path, 'plot_' + filename + '.png')
+        if not force and os.path.isfile(plot_file) and os.path.getmtime(plot_file) >= os.path.getmtime(data_file):
+            continue
+        if os.path.getsize(data_file) == 0:
+            continue
+
+        xlabel, ylabel = labels.get(filename, ('Step', filename))
+        visualization.plot_data_file(filename=filename, xlabel=xlabel, ylabel=ylabel)
+        rendered += 1
+
+    return rendered
+
+
+def find_model_folders(models_path_name):
+    """
+    Return every model folder in the models folder, together with its test folder if present
+    """
+    folders = []
+    for model_folder in sorted(glob.glob(os.path.join(models_path_name, 'model_*', ''))):
+        folders.append(model_folder)
+        test_folder = os.path.join(model_folder, 'test', '')
+        if os.path.isdir(test_folder):
+            folders.append(test_folder)
+    return folders
+
+
+if __name__ == "__main__":
+
+    options, folders = get_options()
+    if options.all:
+        folders = folders + find_model_folders(options.models_path)
+
+    for folder in folders:
+        rendered = plot_folder(folder, options.dpi, options.force)
+        print("----- Plots rendered:", rendered, "in", folder)
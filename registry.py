@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import json
+import sqlite3
+import datetime
+import optparse
+
+
+class RunRegistry:
+    def __init__(self, models_path):
+        self._models_path = models_path
+        os.makedirs(self._models_path, exist_ok=True)
+        self._db_file = os.path.join(self._models_path, 'registry.sqlite')
+        self._create_tables()
+
+
+    def _connect(self):
+        """
+        Open a connection to the index, waiting if another session is writing it
+        """
+        return sqlite3.connect(self._db_file, timeout=60)
+
+
+    def _create_tables(self):
+        """
+        Create the index if it does not exist, the run ids continue after the model folders created before the index
+        """
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")  # lock, so that two sessions do not create the index at the same time
+            exists = db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='runs'").fetchone()
+            if exists:
+                return
+            db.execute("CREATE TABLE runs (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT, status TEXT, created TEXT, settings TEXT, timings TEXT, metrics TEXT)")
+            db.execute("CREATE TABLE tests (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, created TEXT, settings TEXT, timings TEXT, metrics TEXT)")
+            previous_versions = [int(name.split("_")[1]) for name in os.listdir(self._models_path) if name.startswith('model_')]
+            if previous_versions:
+                db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('runs', ?)", (max(previous_versions),))
+
+
+    def allocate_run(self):
+        """
+        Atomically allocate a new run id and create its model folder
+        """
+        while True:
+            with self._connect() as db:
+                cursor = db.execute("INSERT INTO runs (status, created) VALUES ('running', ?)", (datetime.datetime.now().isoformat(),))
+                run_id = cursor.lastrowid
+                path = os.path.join(self._models_path, 'model_' + str(run_id), '')
+                db.execute("UPDATE runs SET path = ? WHERE id = ?", (path, run_id))
+            try:
+                os.mkdir(os.path.dirname(path))
+                return run_id, path
+            except FileExistsError:  # folder created outside the registry, skip its number
+                with self._connect() as db:
+                    db.execute("UPDATE runs SET status = 'skipped' WHERE id = ?", (run_id,))
+
+
+    def record_run(self, run_id, settings, timings, metrics):
+        """
+        Save settings, timing breakdown and final metrics of a training session
+        """
+        with self._connect() as db:
+            db.execute("UPDATE runs SET status = 'done', settings = ?, timings = ?, metrics = ? WHERE id = ?",
+                       (json.dumps(settings), json.dumps(timings), json.dumps(metrics), run_id))
+
+
+    def set_status(self, run_id, status):
+        """
+        Mark a run that did not complete, e.g. 'failed' or 'stopped'
+        """
+        with self._connect() as db:
+            db.execute("UPDATE runs SET status = ? WHERE id = ?", (status, run_id))
+
+
+    def record_test(self, run_id, settings, timings, metrics):
+        """
+        Save settings, timing and metrics of a testing session of the model run_id
+        """
+        with self._connect() as db:
+            db.execute("INSERT INTO tests (run_id, created, settings, timings, metrics) VALUES (?, ?, ?, ?, ?)",
+                       (run_id, datetime.datetime.now().isoformat(), json.dumps(settings), json.dumps(timings), json.dumps(metrics)))
+
+
+    def best(self, metric, filters=None, table='runs', maximize=False, limit=5):
+        """
+        Return the completed runs (or tests) with the best value of the metric, among the ones whose settings match the filters
+        """
+        filters = filters or {}
+        if table == 'runs':
+            query = "SELECT id, path, settings, timings, metrics FROM runs WHERE status = 'done'"
+        else:
+            query = "SELECT run_id, id, settings, timings, metrics FROM tests"
+        with self._connect() as db:
+            rows = db.execute(query).fetchall()
+
+        results = []
+        for run_id, ref, settings, timings, metrics in rows:
+            settings, metrics = json.loads(settings), json.loads(metrics)
+            if metric not in metrics:
+                continue
+            if all(str(settings.get(name)) == value for name, value in filters.items()):
+                results.append((metrics[metric], run_id, ref, settings, json.loads(timings)))
+        results.sort(key=lambda result: result[0], reverse=maximize)
+        return results[:limit]
+
+
+def get_run_id(path):
+    """
+    Return the run id of a model folder path
+    """
+    return int(os.path.basename(os.path.normpath(path)).split("_")[1])
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="usage: %prog [options] metric")
+    optParser.add_option("--models-path", dest="models_path", default="models",
+                         help="folder containing the registry")
+    optParser.add_option("--where", action="append", default=[],
+                         help="setting filter written as name=value, can be repeated")
+    optParser.add_option("--tests", action="store_true", default=False,
+                         help="query the testing sessions instead of the training sessions")
+    optParser.add_option("--max", action="store_true", default=False,
+                         help="the best value is the highest (e.g. reward) instead of the lowest (e.g. delay)")
+    optParser.add_option("--limit", type="int", default=5, help="number of results")
+    options, args = optParser.parse_args()
+    if len(args) != 1:
+        optParser.error("the metric to rank by is required, e.g. final_delay")
+    return options, args[0]
+
+
+if __name__ == "__main__":
+
+    options, metric = get_options()
+    filters = dict(condition.split('=', 1) for condition in options.where)
+    registry = RunRegistry(options.models_path)
+    for value, run_id, ref, settings, timings in registry.best(metric, filters, 'tests' if options.tests else 'runs', options.max, options.limit):
+        print("model_%d" % run_id, metric, "=", value, "- timings:", timings)
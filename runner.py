@@ -5,12 +5,15 @@ import os
 import sys
 import optparse
 import random
-from utils import import_train_configuration, set_sumo, set_train_path
+from utils import import_train_configuration, set_sumo, set_train_path, set_resources, launch_plotter
 from training_simulation import Simulation
-from generator import TrafficGenerator
+from generator import TrafficGenerator, CountsTrafficGenerator
 from memory import Memory
 from model import TrainModel
-from visualization import Visualization
+from metrics import MetricsSink
+from snapshots import SnapshotCache
+from state_encoder import is_binary
+from registry import RunRegistry, get_run_id
 import datetime
 from shutil import copyfile
 
@@ -29,76 +32,153 @@ def get_options():
     optParser = optparse.OptionParser()
     optParser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    optParser.add_option("--config", default="training_settings.ini",
+                         help="training settings file to use")
+    optParser.add_option("--path", default=None,
+                         help="already created folder where the session is saved, instead of a new model folder")
+    optParser.add_option("--route-file", dest="route_file", default=os.path.join('intersection', 'routes.rou.xml'),
+                         help="route file generated for each episode")
+    optParser.add_option("--learner-cores", dest="learner_cores", default=None,
+                         help="cores of the learner (e.g. 0-3), overrides the settings file")
+    optParser.add_option("--sumo-cores", dest="sumo_cores", default=None,
+                         help="cores of sumo (e.g. 4), overrides the settings file")
     options, args = optParser.parse_args()
     return options
 
 
-
-if __name__ == "__main__":
-
-    options = get_options()
-    config = import_train_configuration(config_file='training_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
-    path = set_train_path(config['models_path_name'])
-
-    Model = TrainModel(
-        config['num_layers'], 
-        config['width_layers'], 
-        config['batch_size'], 
-        config['learning_rate'], 
-        input_dim=config['num_states'], 
-        output_dim=config['num_actions']
-    )
-
-    Memory = Memory(
-        config['memory_size_max'], 
-        config['memory_size_min']
-    )
-
-    TrafficGen = TrafficGenerator(
-        config['max_steps'], 
-        config['n_cars_generated']
+def train_session(config, config_file, path, route_file, sumo_cmd, Model, Memory):
+    """
+    Run every episode of a training session with the given model and memory, then save the session in path
+    """
+    if config['counts_file']:
+        TrafficGen = CountsTrafficGenerator(  # demand replayed from traffic counts
+            config['max_steps'],
+            config['counts_file'],
+            route_file,
+            min_gap=config['green_duration']
+        )
+    else:
+        TrafficGen = TrafficGenerator(
+            config['max_steps'], 
+            config['n_cars_generated'],
+            route_file,
+            min_gap=config['green_duration']
+        )
+
+    Metrics = MetricsSink(
+        path,
+        buffer_size=config['metrics_buffer_size']
     )
 
-    Visualization = Visualization(
-        path, 
-        dpi=96
-    )
-        
-    Simulation = Simulation(
+    TrainSimulation = Simulation(
         Model,
         Memory,
         TrafficGen,
+        Metrics,
         sumo_cmd,
         config['gamma'],
         config['max_steps'],
         config['green_duration'],
         config['yellow_duration'],
-        config['num_states'],
         config['num_actions'],
-        config['training_epochs']
+        config['state_channels'],
+        config['training_epochs'],
+        Snapshots=SnapshotCache(config['snapshots_path_name'], TrafficGen) if config['warm_start_step'] > 0 else None,
+        warm_start_step=config['warm_start_step'],
+        fast_forward_idle=config['fast_forward_idle'],
+        target_update_interval=config['target_update_interval']
     )
     
     episode = 0
     timestamp_start = datetime.datetime.now()
+    total_simulation_time = 0
+    total_training_time = 0
+    meso_simulation_time = 0
 
 
     while episode < config['total_episodes']:
         print('\n----- Episode', str(episode+1), 'of', str(config['total_episodes']))
         epsilon = 1.0 - (episode / config['total_episodes'])  # set the epsilon for this episode according to epsilon-greedy policy
-        simulation_time, training_time = Simulation.run(episode, epsilon)  # run the simulation
+        mesosim = episode < config['meso_episodes']  # the first episodes are pre-trained with the mesoscopic simulation
+        simulation_time, training_time = TrainSimulation.run(episode, epsilon, mesosim)  # run the simulation
+        if mesosim:
+            meso_simulation_time += simulation_time
         print('Simulation time:', simulation_time, 's - Training time:', training_time, 's - Total:', round(simulation_time+training_time, 1), 's')
+        total_simulation_time += simulation_time
+        total_training_time += training_time
         episode += 1
 
     print("\n----- Start time:", timestamp_start)
     print("----- End time:", datetime.datetime.now())
     print("----- Session info saved at:", path)
 
-    Model.save_model(path)
+    calibration_states = Memory.get_states(config['calibration_states'])  # states recorded during the episodes
+    Model.save_model(path, config['export_precisions'], calibration_states)
+    if config['export_transitions']:
+        Memory.export(os.path.join(path, 'transitions'))  # experience corpus for offline.py
+    Metrics.close()
+
+    timings = {
+        'simulation': round(total_simulation_time, 1),
+        'training': round(total_training_time, 1),
+        'total': round((datetime.datetime.now() - timestamp_start).total_seconds(), 1),
+        'episodes': episode,
+        'decisions': TrainSimulation.decision_count,
+        'batches': TrainSimulation.batch_count
+    }
+    meso_episodes = min(config['meso_episodes'], episode)
+    if 0 < meso_episodes < episode:
+        # simulation time of a mesoscopic episode compared with a microscopic one
+        micro_time = (total_simulation_time - meso_simulation_time) / (episode - meso_episodes)
+        timings['meso_episodes'] = meso_episodes
+        timings['meso_speedup'] = round(micro_time / max(meso_simulation_time / meso_episodes, 0.1), 2)
+        print("----- Mesoscopic episodes:", meso_episodes, "- simulation speed-up:", timings['meso_speedup'], "x")
+    RunRegistry(os.path.join(os.getcwd(), config['models_path_name'])).record_run(get_run_id(path), config, timings, Metrics.summary())
+
+    if os.path.abspath(config_file) != os.path.abspath(os.path.join(path, 'training_settings.ini')):
+        copyfile(src=config_file, dst=os.path.join(path, 'training_settings.ini'))
+
+    launch_plotter(path)  # plots are rendered by plotter.py in the background
+    return timings
+
+
+def build_model(config):
+    """
+    Build the model of the training session
+    """
+    return TrainModel(
+        config['num_layers'], 
+        config['width_layers'], 
+        config['batch_size'], 
+        config['learning_rate'], 
+        input_dim=config['num_states'], 
+        output_dim=config['num_actions'],
+        cache_size=config['prediction_cache_size']
+    )
 
-    copyfile(src='training_settings.ini', dst=os.path.join(path, 'training_settings.ini'))
 
-    Visualization.save_data_and_plot(data=Simulation.reward_store, filename='reward', xlabel='Episode', ylabel='Cumulative negative reward')
-    Visualization.save_data_and_plot(data=Simulation.cumulative_wait_store, filename='delay', xlabel='Episode', ylabel='Cumulative delay (s)')
-    Visualization.save_data_and_plot(data=Simulation.avg_queue_length_store, filename='queue', xlabel='Episode', ylabel='Average queue length (vehicles)')
-    Visualization.save_data_and_plot(data=Simulation.avg_speed_store, filename='avg_speed', xlabel='Episode', ylabel='Average speed (m/s)')
+def build_memory(config):
+    """
+    Build the replay memory of the training session
+    """
+    return Memory(
+        config['memory_size_max'], 
+        config['memory_size_min'],
+        config['num_states'],
+        packed=is_binary(config['state_channels'])
+    )
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    config = import_train_configuration(config_file=options.config)
+    if options.learner_cores is not None:
+        config['learner_cores'] = options.learner_cores
+    if options.sumo_cores is not None:
+        config['sumo_cores'] = options.sumo_cores
+    set_resources(config['learner_cores'], config['intra_op_threads'], config['inter_op_threads'])
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], options.route_file, config['sumo_cores'])
+    path = options.path if options.path else set_train_path(config['models_path_name'])
+
+    train_session(config, options.config, path, options.route_file, sumo_cmd, build_model(config), build_memory(config))
@@ -0,0 +1,191 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import optparse
+import timeit
+import importlib
+
+from multiprocessing.connection import Listener, Client
+from utils import import_train_configuration, import_test_configuration, set_sumo, set_train_path, set_test_path
+
+
+def get_options():
+    optParser = optparse.OptionParser(usage="usage: %prog --serve | --submit train|test [--config file]")
+    optParser.add_option("--serve", action="store_true", default=False, help="start the service")
+    optParser.add_option("--submit", default=None, help="send a job to the running service: train or test")
+    optParser.add_option("--config", default=None, help="settings file of the job")
+    optParser.add_option("--keep-memory", dest="keep_memory", action="store_true", default=False,
+                         help="start the training job with the replay memory left by the previous one")
+    optParser.add_option("--port", type="int", default=6100, help="local port of the service")
+    options, args = optParser.parse_args()
+    return options
+
+
+def get_key_file(port):
+    """
+    Return the file holding the authentication key of the service on the port, in the home folder of the user
+    """
+    return os.path.join(os.path.expanduser('~'), '.intellilights_service_%d.key' % port)
+
+
+def create_authkey(port):
+    """
+    Generate a random authentication key for this run of the service and save it readable only by the user
+    the connections exchange pickled messages, so only clients knowing the key must be able to connect
+    """
+    authkey = os.urandom(32)
+    key_file = get_key_file(port)
+    file_descriptor = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(key_file, 0o600)  # the file may exist from a previous run with other permissions
+    with os.fdopen(file_descriptor, "wb") as file:
+        file.write(authkey)
+    return authkey
+
+
+def read_authkey(port):
+    """
+    Read the authentication key saved by the running service
+    """
+    key_file = get_key_file(port)
+    if not os.path.isfile(key_file):
+        sys.exit("No service key in %s, start the service with --serve first" % key_file)
+    with open(key_file, "rb") as file:
+        return file.read()
+
+
+class TrainerService:
+    def __init__(self):
+        # tensorflow is imported once for every job of the service (and not by the clients)
+        start_time = timeit.default_timer()
+        self._runner = importlib.import_module('runner')
+        self._testing_main = importlib.import_module('testing_main')
+        self._import_time = timeit.default_timer() - start_time
+
+        self._train_models = {}  # architecture -> (TrainModel, build time)
+        self._test_models = {}  # (model path, precision, cache size) -> (TestModel, load time)
+        self._memories = {}  # memory shape -> Memory
+
+
+    def run_job(self, job):
+        """
+        Run a training or testing job reusing the warm models and memories, return its turnaround and the estimated cold start one
+        """
+        start_time = timeit.default_timer()
+        if job['kind'] == 'train':
+            result, cold_setup = self._train(job)
+        elif job['kind'] == 'test':
+            result, cold_setup = self._test(job)
+        else:
+            return {'error': "unknown job kind '%s'" % job['kind']}
+        turnaround = timeit.default_timer() - start_time
+
+        result['turnaround'] = round(turnaround, 2)
+        result['cold_turnaround'] = round(turnaround + self._import_time + cold_setup, 2)  # what a fresh process would also spend
+        return result
+
+
+    def _train(self, job):
+        """
+        Training job: the model is reset to its initial weights instead of being rebuilt and compiled again
+        """
+        config_file = job.get('config') or 'training_settings.ini'
+        config = import_train_configuration(config_file)
+        sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+        path = set_train_path(config['models_path_name'])
+
+        key = (config['num_layers'], config['width_layers'], config['batch_size'], config['learning_rate'],
+               config['num_states'], config['num_actions'], config['prediction_cache_size'])
+        if key in self._train_models:
+            Model, build_time = self._train_models[key]
+            Model.reset()
+        else:
+            start_time = timeit.default_timer()
+            Model = self._runner.build_model(config)
+            build_time = timeit.default_timer() - start_time
+            self._train_models[key] = (Model, build_time)
+
+        memory_key = (config['memory_size_max'], config['memory_size_min'], config['num_states'], tuple(config['state_channels']))
+        if memory_key not in self._memories:
+            self._memories[memory_key] = self._runner.build_memory(config)
+        Memory = self._memories[memory_key]
+        if not job.get('keep_memory'):
+            Memory.clear()
+
+        timings = self._runner.train_session(config, config_file, path, os.path.join('intersection', 'routes.rou.xml'), sumo_cmd, Model, Memory)
+        return {'path': path, 'timings': timings}, build_time
+
+
+    def _test(self, job):
+        """
+        Testing job: the loaded models are kept, so testing the same model again skips loading it
+        """
+        config_file = job.get('config') or 'testing_settings.ini'
+        config = import_test_configuration(config_file)
+        sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
+        model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
+
+        key = (model_path, config['model_precision'], config['prediction_cache_size'])
+        if key in self._test_models:
+            Model, load_time = self._test_models[key]
+        else:
+            start_time = timeit.default_timer()
+            Model = self._testing_main.build_model(config, model_path)
+            load_time = timeit.default_timer() - start_time
+            self._test_models[key] = (Model, load_time)
+        Model.cache.reset_stats()  # the hit rate reported by the job counts only its own predictions
+
+        simulation_time = self._testing_main.test_session(config, config_file, plot_path, os.path.join('intersection', 'routes.rou.xml'), sumo_cmd, Model)
+        return {'path': plot_path, 'timings': {'simulation': simulation_time}}, load_time
+
+
+    def close_simulation(self):
+        """
+        Close the sumo connection left open by a job that failed in the middle of an episode, so that the next job can start sumo
+        """
+        try:
+            self._runner.traci.close()
+        except Exception:
+            pass  # no connection open, the job has closed it
+
+
+    @property
+    def import_time(self):
+        return self._import_time
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    address = ('localhost', options.port)
+
+    if options.serve:
+        service = TrainerService()
+        authkey = create_authkey(options.port)
+        print("----- Service ready on port", options.port, "- startup:", round(service.import_time, 1), "s")
+        with Listener(address, authkey=authkey) as listener:
+            while True:
+                with listener.accept() as connection:
+                    job = connection.recv()
+                    if job['kind'] == 'stop':
+                        connection.send({'stopped': True})
+                        os.remove(get_key_file(options.port))
+                        break
+                    print("\n----- Job:", job)
+                    try:
+                        result = service.run_job(job)
+                    except (Exception, SystemExit) as error:  # a failed job must not stop the service, sys.exit included
+                        result = {'error': repr(error)}
+                    finally:
+                        service.close_simulation()
+                    print("----- Result:", result)
+                    connection.send(result)
+
+    elif options.submit:
+        with Client(address, authkey=read_authkey(options.port)) as connection:
+            connection.send({'kind': options.submit, 'config': options.config, 'keep_memory': options.keep_memory})
+            print(connection.recv())
+
+    else:
+        sys.exit("use --serve to start the service or --submit to send a job")
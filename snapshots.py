@@ -0,0 +1,35 @@
+import os
+import traci
+
+
+class SnapshotCache:
+    def __init__(self, path, TrafficGen):
+        self._path = path
+        self._TrafficGen = TrafficGen
+        os.makedirs(self._path, exist_ok=True)
+
+
+    def warm_start(self, seed, step, mesosim=False):
+        """
+        Bring the running simulation to the given step: load the cached state of the (route seed, step) pair if present,
+        otherwise simulate the warm-up in a single call with the default traffic light program and cache the reached state
+        """
+        state_file = self._state_file(seed, step, mesosim)
+        if os.path.isfile(state_file):
+            traci.simulation.loadState(state_file)
+            return True
+
+        traci.simulationStep(step)  # run until the simulation time reaches 'step'
+        tmp_file = state_file + '.' + str(os.getpid())
+        traci.simulation.saveState(tmp_file)
+        os.replace(tmp_file, state_file)  # atomic, other processes never see a partially written snapshot
+        return False
+
+
+    def _state_file(self, seed, step, mesosim):
+        """
+        Return the path of the snapshot, which identifies the generated demand (scenario, seed) and the step of the episode
+        mesoscopic and microscopic states cannot be loaded by each other, so they are cached separately
+        """
+        name = 'state_%s_%d_%d%s.xml' % (self._TrafficGen.scenario_id, seed, step, '_meso' if mesosim else '')
+        return os.path.join(self._path, name)
@@ -0,0 +1,137 @@
+import bisect
+import traci
+import traci.constants as tc
+import numpy as np
+
+# distance in meters from the traffic light where each cell of a lane group ends, the last cell goes up to 750 = max len of a road
+CELL_LIMITS = [7, 14, 21, 28, 40, 60, 100, 160, 400]
+NUM_CELLS = len(CELL_LIMITS) + 1
+NUM_LANE_GROUPS = 8
+NUM_PHASES = 8  # phases of the TrafficLight program, green and yellow for every action
+
+CELL_CHANNELS = ['occupancy', 'speed', 'wait']  # channels with one value per cell
+CHANNELS = CELL_CHANNELS + ['phase']
+
+
+def get_num_states(channels):
+    """
+    Return the size of the state produced by the encoder for the given channels
+    """
+    for channel in channels:
+        if channel not in CHANNELS:
+            raise ValueError("Unknown state channel '%s', the channels are %s" % (channel, ', '.join(CHANNELS)))
+    num_cell_channels = len([channel for channel in channels if channel in CELL_CHANNELS])
+    return num_cell_channels * NUM_LANE_GROUPS * NUM_CELLS + (NUM_PHASES if 'phase' in channels else 0)
+
+
+def is_binary(channels):
+    """
+    Check if the state contains only 0/1 values, so that it can be stored bit-packed
+    """
+    return all(channel in ('occupancy', 'phase') for channel in channels)
+
+
+class StateEncoder:
+    def __init__(self, lane_groups, channels, traffic_light_id="TrafficLight", radius=800):
+        self._lane_groups = lane_groups  # lane id -> lane group
+        self._channels = channels
+        self._traffic_light_id = traffic_light_id
+        self._radius = radius
+        self._num_states = get_num_states(channels)
+        self._mesosim = False
+        self._wait_variable = tc.VAR_ACCUMULATED_WAITING_TIME
+        self._movement_groups = {}  # (incoming edge, next edge) -> lane group, used in mesoscopic mode
+
+        # offset of every channel in the state array
+        self._offsets = {}
+        offset = 0
+        for channel in channels:
+            self._offsets[channel] = offset
+            offset += NUM_PHASES if channel == 'phase' else NUM_LANE_GROUPS * NUM_CELLS
+
+
+    def subscribe(self, mesosim=False):
+        """
+        Subscribe to the variables of every vehicle around the traffic light, to be called after sumo is started
+        sumo then sends all of them at every step, instead of one request per vehicle and variable
+        """
+        self._mesosim = mesosim
+        # the accumulated waiting time is only implemented for microscopic cars, mesoscopic ones report their current waiting time
+        self._wait_variable = tc.VAR_WAITING_TIME if mesosim else tc.VAR_ACCUMULATED_WAITING_TIME
+        if mesosim:
+            # the mesoscopic cars are not on a lane, their lane group is the one of the lanes leading to their next edge
+            self._movement_groups = self._get_movement_groups()
+            variables = [tc.VAR_ROAD_ID, tc.VAR_ROUTE_INDEX, tc.VAR_EDGES, tc.VAR_LANEPOSITION]
+        else:
+            variables = [tc.VAR_LANE_ID, tc.VAR_LANEPOSITION]
+        if 'speed' in self._channels:
+            variables.append(tc.VAR_SPEED)
+        if 'wait' in self._channels:
+            variables.append(self._wait_variable)
+        traci.junction.subscribeContext(self._traffic_light_id, tc.CMD_GET_VEHICLE_VARIABLE, self._radius, variables)
+
+
+    def encode(self):
+        """
+        Retrieve the state of the intersection from the bulk observation of sumo, filling every channel in a single pass
+        """
+        state = np.zeros(self._num_states)
+        cells = NUM_LANE_GROUPS * NUM_CELLS
+        counts = np.zeros(cells)  # cars per cell, to average the speed
+        vehicles = traci.junction.getContextSubscriptionResults(self._traffic_light_id) or {}
+
+        for values in vehicles.values():
+            lane_group = self._get_lane_group(values)
+            if lane_group < 0:
+                continue  # not detecting cars crossing the intersection or driving away from it
+
+            lane_pos = 750 - values[tc.VAR_LANEPOSITION]  # inversion of lane pos, so if the car is close to the traffic light -> lane_pos = 0
+            car_position = lane_group * NUM_CELLS + bisect.bisect_right(CELL_LIMITS, lane_pos)  # number in interval 0-79
+            counts[car_position] += 1
+
+            if 'speed' in self._offsets:
+                state[self._offsets['speed'] + car_position] += values[tc.VAR_SPEED]
+            if 'wait' in self._offsets:
+                state[self._offsets['wait'] + car_position] += max(values[self._wait_variable], 0)
+
+        if 'occupancy' in self._offsets:
+            state[self._offsets['occupancy']:self._offsets['occupancy'] + cells] = counts > 0  # in the form of "cell occupied"
+        if 'speed' in self._offsets:
+            speed = state[self._offsets['speed']:self._offsets['speed'] + cells]
+            np.divide(speed, counts, out=speed, where=counts > 0)  # mean speed of the cars in the cell
+        if 'phase' in self._offsets:
+            state[self._offsets['phase'] + traci.trafficlight.getPhase(self._traffic_light_id)] = 1
+
+        return state
+
+
+    def _get_lane_group(self, values):
+        """
+        Return the lane group of a subscribed car, -1 if it is not approaching the traffic light
+        """
+        if not self._mesosim:
+            return self._lane_groups.get(values[tc.VAR_LANE_ID], -1)
+        route, route_index = values[tc.VAR_EDGES], values[tc.VAR_ROUTE_INDEX]
+        if values[tc.VAR_ROAD_ID] != route[route_index] or route_index + 1 >= len(route):
+            return -1  # inside the junction or at the end of the route
+        return self._movement_groups.get((route[route_index], route[route_index + 1]), -1)
+
+
+    def _get_movement_groups(self):
+        """
+        Map every movement through the traffic light to the lane group of the lanes it starts from
+        when several lanes allow a movement, the leftmost one is used
+        """
+        network_lanes = set(traci.lane.getIDList())
+        movement_groups = {}
+        for lane_id in sorted(self._lane_groups):
+            if lane_id not in network_lanes:
+                continue
+            for link in traci.lane.getLinks(lane_id):
+                movement_groups[(traci.lane.getEdgeID(lane_id), traci.lane.getEdgeID(link[0]))] = self._lane_groups[lane_id]
+        return movement_groups
+
+
+    @property
+    def num_states(self):
+        return self._num_states
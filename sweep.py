@@ -0,0 +1,182 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import optparse
+import itertools
+import subprocess
+import configparser
+
+from utils import set_train_path
+from registry import RunRegistry, get_run_id
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--config", default="sweep_settings.ini",
+                         help="sweep settings file to use")
+    options, args = optParser.parse_args()
+    return options
+
+
+def import_sweep_configuration(config_file):
+    """
+    Read the config file regarding the sweep and import its content
+    """
+    content = configparser.ConfigParser()
+    content.read(config_file)
+    config = {}
+    config['base_config'] = content['sweep']['base_config']
+    base_content = configparser.ConfigParser()
+    base_content.read(config['base_config'])
+    config['models_path_name'] = base_content['dir']['models_path_name']
+    config['search'] = content['sweep']['search']
+    config['n_trials'] = content['sweep'].getint('n_trials')
+    config['seed'] = content['sweep'].getint('seed')
+    config['max_parallel'] = content['sweep'].getint('max_parallel')
+    config['threads_per_trial'] = content['sweep'].getint('threads_per_trial')
+    config['early_stop_episodes'] = content['sweep'].getint('early_stop_episodes')
+    config['early_stop_tolerance'] = content['sweep'].getfloat('early_stop_tolerance')
+    config['grid'] = {name: [value.strip() for value in values.split(',')] for name, values in content['grid'].items()}
+    return config
+
+
+def expand_trials(grid, search, n_trials, seed):
+    """
+    Return the list of parameter combinations to try: every combination of the grid, or n_trials random ones
+    """
+    names = list(grid)
+    if search == 'grid':
+        return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    elif search == 'random':
+        rng = random.Random(seed)
+        return [{name: rng.choice(grid[name]) for name in names} for _ in range(n_trials)]
+    else:
+        sys.exit("unknown search '%s', use 'grid' or 'random'" % search)
+
+
+def write_trial_settings(base_config, params, path):
+    """
+    Write the training settings of a trial in its model folder, overriding the parameters of the base settings
+    """
+    content = configparser.ConfigParser()
+    content.read(base_config)
+    for name, value in params.items():
+        sections = [section for section in content.sections() if name in content[section]]
+        if not sections:
+            sys.exit("parameter '%s' is not part of %s" % (name, base_config))
+        content[sections[0]][name] = value
+
+    settings_file = os.path.join(path, 'training_settings.ini')
+    with open(settings_file, "w") as file:
+        content.write(file)
+    return settings_file
+
+
+def read_rewards(path):
+    """
+    Read the episode rewards streamed so far by a trial
+    the trial may be appending to the file, so a last line without newline is not complete yet and is skipped
+    """
+    data_file = os.path.join(path, 'plot_reward_data.txt')
+    if not os.path.isfile(data_file):
+        return []
+    rewards = []
+    with open(data_file, "r") as file:
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            try:
+                rewards.append(float(line))
+            except ValueError:
+                continue
+    return rewards
+
+
+def is_lagging(rewards, others, min_episodes, tolerance):
+    """
+    Compare the mean reward of a trial with the best trial over the same number of episodes
+    the reward is negative, so a trial lags if it is more than 'tolerance' (relative) below the best one
+    """
+    n = len(rewards)
+    if n < min_episodes:
+        return False
+
+    comparable = [other[:n] for other in others if len(other) >= n]
+    if not comparable:
+        return False
+
+    mean = sum(rewards) / n
+    best = max(sum(other) / n for other in comparable)
+    return best - mean > tolerance * abs(best)
+
+
+def launch_trial(settings_file, path, threads):
+    """
+    Start runner.py on the trial settings, with its own model folder, route file and thread budget
+    """
+    env = dict(os.environ)
+    env['OMP_NUM_THREADS'] = str(threads)
+    env['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    env['TF_NUM_INTEROP_THREADS'] = '1'
+    cmd = [sys.executable, 'runner.py', '--config', settings_file, '--path', path, '--route-file', os.path.join(path, 'routes.rou.xml')]
+    log = open(os.path.join(path, 'runner_output.txt'), "w")
+    return subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT), log
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    config = import_sweep_configuration(options.config)
+    trials = expand_trials(config['grid'], config['search'], config['n_trials'], config['seed'])
+    registry = RunRegistry(os.path.join(os.getcwd(), config['models_path_name'], ''))
+    print("----- Sweep of", len(trials), "trials,", config['max_parallel'], "at a time")
+
+    pending = list(enumerate(trials))
+    running = {}  # trial number -> (process, log, path)
+    finished = {}  # trial number -> (path, status)
+    curves = {}  # trial number -> rewards of the episodes done so far
+
+    while pending or running:
+
+        # fill the free slots of the pool
+        while pending and len(running) < config['max_parallel']:
+            n, params = pending.pop(0)
+            path = set_train_path(config['models_path_name'])
+            settings_file = write_trial_settings(config['base_config'], params, path)
+            process, log = launch_trial(settings_file, path, config['threads_per_trial'])
+            running[n] = (process, log, path)
+            print("Trial", n, params, "started in", path)
+
+        time.sleep(5)
+
+        for n in list(running):
+            process, log, path = running[n]
+            curves[n] = read_rewards(path)
+
+            if process.poll() is not None:
+                status = 'done' if process.returncode == 0 else 'failed (%d)' % process.returncode
+                if process.returncode != 0:
+                    registry.set_status(get_run_id(path), 'failed')
+            elif is_lagging(curves[n], [curves[m] for m in curves if m != n], config['early_stop_episodes'], config['early_stop_tolerance']):
+                process.terminate()
+                process.wait()
+                status = 'stopped early'
+                registry.set_status(get_run_id(path), 'stopped')
+            else:
+                continue
+
+            log.close()
+            finished[n] = (path, status)
+            del running[n]
+            print("Trial", n, status, "after", len(curves[n]), "episodes")
+
+    print("\n----- Sweep results (mean reward over the episodes done)")
+    for n, params in enumerate(trials):
+        path, status = finished[n]
+        rewards = curves.get(n, [])
+        mean = sum(rewards) / len(rewards) if rewards else float('nan')
+        print(n, path, status, len(rewards), round(mean, 1), params)
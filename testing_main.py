@@ -2,54 +2,110 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import os
+import optparse
 from shutil import copyfile
 
 from testing_simulation import Simulation
-from generator import TrafficGenerator
+from generator import TrafficGenerator, CountsTrafficGenerator
 from model import TestModel
-from visualization import Visualization
-from utils import import_test_configuration, set_sumo, set_test_path
+from metrics import MetricsSink
+from snapshots import SnapshotCache
+from registry import RunRegistry
+from utils import import_test_configuration, set_sumo, set_test_path, set_resources, launch_plotter
 
 
-if __name__ == "__main__":
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--config", default="testing_settings.ini",
+                         help="testing settings file to use")
+    optParser.add_option("--route-file", dest="route_file", default=os.path.join('intersection', 'routes.rou.xml'),
+                         help="route file generated for the test episode")
+    optParser.add_option("--test-folder", dest="test_folder", default="test",
+                         help="folder of the model where the results are saved, parallel tests of a model need one each")
+    optParser.add_option("--learner-cores", dest="learner_cores", default=None,
+                         help="cores of the model (e.g. 0-3), overrides the settings file")
+    optParser.add_option("--sumo-cores", dest="sumo_cores", default=None,
+                         help="cores of sumo (e.g. 4), overrides the settings file")
+    options, args = optParser.parse_args()
+    return options
 
-    config = import_test_configuration(config_file='testing_settings.ini')
-    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'])
-    model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'])
 
-    Model = TestModel(
-        input_dim=config['num_states'],
-        model_path=model_path
-    )
+def test_session(config, config_file, plot_path, route_file, sumo_cmd, Model):
+    """
+    Run the test episode with the given model and save its results in plot_path
+    """
+    if config['counts_file']:
+        TrafficGen = CountsTrafficGenerator(  # demand replayed from traffic counts
+            config['max_steps'],
+            config['counts_file'],
+            route_file,
+            min_gap=config['green_duration']
+        )
+    else:
+        TrafficGen = TrafficGenerator(
+            config['max_steps'], 
+            config['n_cars_generated'],
+            route_file,
+            min_gap=config['green_duration']
+        )
 
-    TrafficGen = TrafficGenerator(
-        config['max_steps'], 
-        config['n_cars_generated']
+    Metrics = MetricsSink(
+        plot_path,
+        buffer_size=config['metrics_buffer_size']
     )
 
-    Visualization = Visualization(
-        plot_path, 
-        dpi=96
-    )
-        
-    Simulation = Simulation(
+    TestSimulation = Simulation(
         Model,
         TrafficGen,
+        Metrics,
         sumo_cmd,
         config['max_steps'],
         config['green_duration'],
         config['yellow_duration'],
-        config['num_states'],
-        config['num_actions']
+        config['num_actions'],
+        config['state_channels'],
+        Snapshots=SnapshotCache(config['snapshots_path_name'], TrafficGen) if config['warm_start_step'] > 0 else None,
+        warm_start_step=config['warm_start_step'],
+        fast_forward_idle=config['fast_forward_idle']
     )
 
     print('\n----- Test episode')
-    simulation_time = Simulation.run(config['episode_seed'])  # run the simulation
+    simulation_time = TestSimulation.run(config['episode_seed'])  # run the simulation
     print('Simulation time:', simulation_time, 's')
+    Metrics.close()
+
+    RunRegistry(os.path.join(os.getcwd(), config['models_path_name'])).record_test(config['model_to_test'], config, {'simulation': simulation_time}, Metrics.summary())
 
     print("----- Testing info saved at:", plot_path)
 
-    copyfile(src='testing_settings.ini', dst=os.path.join(plot_path, 'testing_settings.ini'))
+    copyfile(src=config_file, dst=os.path.join(plot_path, 'testing_settings.ini'))
+
+    launch_plotter(plot_path)  # plots are rendered by plotter.py in the background
+    return simulation_time
+
+
+def build_model(config, model_path):
+    """
+    Load the model to test
+    """
+    return TestModel(
+        input_dim=config['num_states'],
+        model_path=model_path,
+        precision=config['model_precision'],
+        cache_size=config['prediction_cache_size']
+    )
+
+
+if __name__ == "__main__":
+
+    options = get_options()
+    config = import_test_configuration(config_file=options.config)
+    if options.learner_cores is not None:
+        config['learner_cores'] = options.learner_cores
+    if options.sumo_cores is not None:
+        config['sumo_cores'] = options.sumo_cores
+    set_resources(config['learner_cores'], config['intra_op_threads'], config['inter_op_threads'])
+    sumo_cmd = set_sumo(config['gui'], config['sumocfg_file_name'], config['max_steps'], options.route_file, config['sumo_cores'])
+    model_path, plot_path = set_test_path(config['models_path_name'], config['model_to_test'], options.test_folder)
 
-    Visualization.save_data_and_plot(data=Simulation.reward_episode, filename='reward', xlabel='Action step', ylabel='Reward')
-    Visualization.save_data_and_plot(data=Simulation.queue_length_episode, filename='queue', xlabel='Step', ylabel='Queue lenght (vehicles)')
+    test_session(config, options.config, plot_path, options.route_file, sumo_cmd, build_model(config, model_path))
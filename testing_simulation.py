@@ -3,6 +3,10 @@ import numpy as np
 import random
 import timeit
 import os
+import math
+
+from waiting_times import WaitingTimeTracker
+from state_encoder import StateEncoder
 
 # phase codes based on incrocio_prova.net.xml, the actions are intended as put green phase of the traffic light, so we have two actions : NS Green, EW Green
 PHASE_NS_GREEN = 0  # Action 0
@@ -14,21 +18,33 @@ PHASE_EW_YELLOW = 5
 PHASE_EWL_GREEN = 6 # Action 3
 PHASE_EWL_YELLOW = 7
 
+# lane groups of the state, one per lane of the first two lanes of every incoming road
+LANE_GROUPS = {
+    "WE2TrafficLight_0": 0, "WE2TrafficLight_1": 1,
+    "North2TrafficLight_0": 2, "North2TrafficLight_1": 3,
+    "East2TrafficLight_0": 4, "East2TrafficLight_1": 5,
+    "South2TrafficLight_0": 6, "South2TrafficLight_1": 7,
+}
+
 
 
 class Simulation:
-    def __init__(self, Model, TrafficGen, sumo_cmd, max_steps, green_duration, yellow_duration, num_states, num_actions):
+    def __init__(self, Model, TrafficGen, Metrics, sumo_cmd, max_steps, green_duration, yellow_duration, num_actions, state_channels, Snapshots=None, warm_start_step=0, fast_forward_idle=False):
         self._Model = Model
         self._TrafficGen = TrafficGen
+        self._Metrics = Metrics
         self._step = 0
         self._sumo_cmd = sumo_cmd
         self._max_steps = max_steps
         self._green_duration = green_duration
         self._yellow_duration = yellow_duration
-        self._num_states = num_states
+        self._StateEncoder = StateEncoder(LANE_GROUPS, state_channels)
+        self._num_states = self._StateEncoder.num_states
         self._num_actions = num_actions
-        self._reward_episode = []
-        self._queue_length_episode = []
+        self._Snapshots = Snapshots
+        self._warm_start_step = warm_start_step
+        self._fast_forward_idle = fast_forward_idle
+        self._WaitingTimes = WaitingTimeTracker()
 
 
     def run(self, episode):
@@ -44,12 +60,26 @@ class Simulation:
 
         # inits
         self._step = 0
-        self._waiting_times = {}
+        self._WaitingTimes.reset()
         old_total_wait = 0
         old_action = -1 # dummy init
 
+        # optionally start from a pre-warmed traffic state, shared by every evaluation on the same seed
+        if self._Snapshots is not None and self._warm_start_step > 0:
+            self._Snapshots.warm_start(seed=episode, step=self._warm_start_step)
+            self._step = self._warm_start_step
+            old_total_wait = self._collect_waiting_times()
+
+        self._StateEncoder.subscribe()  # after the warm start, so that the subscription refers to the loaded state
+
         while self._step < self._max_steps:
 
+            # no car in the network and none departing soon: jump to the next departure instead of deciding every green interval
+            idle_steps = self._idle_steps()
+            if idle_steps > 0:
+                self._fast_forward(idle_steps)
+                continue
+
             # get current state of the intersection
             current_state = self._get_state()
 
@@ -62,7 +92,7 @@ class Simulation:
             action = self._choose_action(current_state)
 
             # if the chosen phase is different from the last phase, activate the yellow phase
-            if self._step != 0 and old_action != action:
+            if old_action != -1 and old_action != action:
                 self._set_yellow_phase(old_action)
                 self._simulate(self._yellow_duration)
 
@@ -74,9 +104,11 @@ class Simulation:
             old_action = action
             old_total_wait = current_total_wait
 
-            self._reward_episode.append(reward)
+            self._Metrics.append('reward', reward)
 
-        #print("Total reward:", np.sum(self._reward_episode))
+        self._Metrics.flush()
+        #print("Total reward:", self._Metrics.stats('reward').sum)
+        print("Prediction cache:", self._Model.cache.report())
         traci.close()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
@@ -95,25 +127,37 @@ class Simulation:
             self._step += 1 # update the step counter
             steps_todo -= 1
             queue_length = self._get_queue_length() 
-            self._queue_length_episode.append(queue_length)
+            self._Metrics.append('queue', queue_length)  # streamed to disk, nothing is kept in memory
+
+
+    def _fast_forward(self, steps):
+        """
+        Skip idle steps with a single call to sumo, every skipped step has an empty queue
+        """
+        traci.simulationStep(traci.simulation.getTime() + steps)  # simulate until the given time
+        self._step += steps
+        for _ in range(steps):
+            self._Metrics.append('queue', 0)
+
+
+    def _idle_steps(self):
+        """
+        Return how many steps can be skipped because the network is empty, no car is waiting to be inserted and none departs before
+        """
+        if not self._fast_forward_idle or traci.vehicle.getIDCount() > 0 or traci.simulation.getPendingVehicles():
+            return 0
+
+        next_departure = self._TrafficGen.next_departure(self._step)
+        if next_departure >= self._max_steps:
+            return self._max_steps - self._step
+        return max(0, int(math.floor(next_departure)) - self._step - 1)  # stop just before the departure
 
 
     def _collect_waiting_times(self):
         """
-        Retrieve the waiting time of every car in the incoming roads
+        Retrieve the total waiting time of the cars in the incoming roads, updated incrementally
         """
-        incoming_roads = ["East2Traffighlight", "North2TrafficLight", "WE2TrafficLight", "South2TrafficLight"]
-        car_list = traci.vehicle.getIDList()
-        for car_id in car_list:
-            wait_time = traci.vehicle.getAccumulatedWaitingTime(car_id)
-            road_id = traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
-            if road_id in incoming_roads:  # consider only the waiting times of cars in incoming roads
-                self._waiting_times[car_id] = wait_time
-            else:
-                if car_id in self._waiting_times: # a car that was tracked has cleared the intersection
-                    del self._waiting_times[car_id] 
-        total_waiting_time = sum(self._waiting_times.values())
-        return total_waiting_time
+        return self._WaitingTimes.update()
 
 
     def _choose_action(self, state):
@@ -160,81 +204,9 @@ class Simulation:
 
     def _get_state(self):
         """
-        Retrieve the state of the intersection from sumo, in the form of cell occupancy
-        """
-        state = np.zeros(self._num_states)
-        car_list = traci.vehicle.getIDList()
-
-        for car_id in car_list:
-            lane_pos = traci.vehicle.getLanePosition(car_id)
-            lane_id = traci.vehicle.getLaneID(car_id)
-            lane_pos = 750 - lane_pos  # inversion of lane pos, so if the car is close to the traffic light -> lane_pos = 0 --- 750 = max len of a road
-
-            # distance in meters from the traffic light -> mapping into cells
-            if lane_pos < 7:
-                lane_cell = 0
-            elif lane_pos < 14:
-                lane_cell = 1
-            elif lane_pos < 21:
-                lane_cell = 2
-            elif lane_pos < 28:
-                lane_cell = 3
-            elif lane_pos < 40:
-                lane_cell = 4
-            elif lane_pos < 60:
-                lane_cell = 5
-            elif lane_pos < 100:
-                lane_cell = 6
-            elif lane_pos < 160:
-                lane_cell = 7
-            elif lane_pos < 400:
-                lane_cell = 8
-            elif lane_pos <= 750:
-                lane_cell = 9
-
-            # finding the lane where the car is located 
-            if lane_id == "WE2TrafficLight_0":
-                lane_group = 0
-            elif lane_id == "WE2TrafficLight_1":
-                lane_group = 1
-            elif lane_id == "North2TrafficLight_0":
-                lane_group = 2
-            elif lane_id == "North2TrafficLight_1":
-                lane_group = 3
-            elif lane_id == "East2TrafficLight_0":
-                lane_group = 4
-            elif lane_id == "East2TrafficLight_1":
-                lane_group = 5
-            elif lane_id == "South2TrafficLight_0":
-                lane_group = 6
-            elif lane_id == "South2TrafficLight_1":
-                lane_group = 7
-            else:
-                lane_group = -1
-
-            if lane_group >= 1 and lane_group <= 7:
-                car_position = int(str(lane_group) + str(lane_cell))  # composition of the two postion ID to create a number in interval 0-79
-                valid_car = True
-            elif lane_group == 0:
-                car_position = lane_cell
-                valid_car = True
-            else:
-                valid_car = False  # flag for not detecting cars crossing the intersection or driving away from it
-
-            if valid_car:
-                state[car_position] = 1  # write the position of the car car_id in the state array in the form of "cell occupied"
-
-        return state
-
-
-    @property
-    def queue_length_episode(self):
-        return self._queue_length_episode
-
-
-    @property
-    def reward_episode(self):
-        return self._reward_episode
+        Retrieve the state of the intersection from sumo, in the form of the configured channels (cell occupancy by default)
+        """
+        return self._StateEncoder.encode()
 
 
 
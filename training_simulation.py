@@ -3,6 +3,11 @@ import numpy as np
 import random
 import timeit
 import os
+import math
+
+from waiting_times import WaitingTimeTracker
+from state_encoder import StateEncoder
+from utils import MESOSIM_OPTIONS
 
 # phase codes based on incrocio_prova.net.xml, the actions are intended as put green phase of the traffic light, so we have two actions : NS Green, EW Green
 PHASE_NS_GREEN = 0  # Action 0
@@ -14,42 +19,57 @@ PHASE_EW_YELLOW = 5
 PHASE_EWL_GREEN = 6 # Action 3
 PHASE_EWL_YELLOW = 7
 
+# lane groups of the state, the two lanes going straight or right share a group, the left-turn lane has its own
+LANE_GROUPS = {
+    "WE2TrafficLight_0": 0, "WE2TrafficLight_1": 0, "WE2TrafficLight_2": 1,
+    "North2TrafficLight_0": 2, "North2TrafficLight_1": 2, "North2TrafficLight_2": 3,
+    "East2TrafficLight_0": 4, "East2TrafficLight_1": 4, "East2TrafficLight_2": 5,
+    "South2TrafficLight_0": 6, "South2TrafficLight_1": 6, "South2TrafficLight_2": 7,
+}
+
 
 
 class Simulation:
-    def __init__(self, Model, Memory, TrafficGen, sumo_cmd, gamma, max_steps, green_duration, yellow_duration, num_states, num_actions, training_epochs):
+    def __init__(self, Model, Memory, TrafficGen, Metrics, sumo_cmd, gamma, max_steps, green_duration, yellow_duration, num_actions, state_channels, training_epochs, Snapshots=None, warm_start_step=0, fast_forward_idle=False, target_update_interval=0):
         self._Model = Model
         self._Memory = Memory
         self._TrafficGen = TrafficGen
+        self._Metrics = Metrics
         self._gamma = gamma
         self._step = 0
         self._sumo_cmd = sumo_cmd
         self._max_steps = max_steps
         self._green_duration = green_duration
         self._yellow_duration = yellow_duration
-        self._num_states = num_states
+        self._StateEncoder = StateEncoder(LANE_GROUPS, state_channels)
+        self._num_states = self._StateEncoder.num_states
         self._num_actions = num_actions
-        self._reward_store = []
-        self._cumulative_wait_store = []
-        self._avg_queue_length_store = []
-        self._avg_speed_store = []
+        self._WaitingTimes = WaitingTimeTracker()
         self._training_epochs = training_epochs
+        self._Snapshots = Snapshots
+        self._warm_start_step = warm_start_step
+        self._fast_forward_idle = fast_forward_idle
+        self._target_update_interval = target_update_interval  # batches between syncs of the target network, 0 = no target network
+        self._decision_count = 0
+        self._batch_count = 0
 
 
-    def run(self, episode, epsilon):
+    def run(self, episode, epsilon, mesosim=False):
         """
         Runs an episode of simulation, then starts a training session
+        with mesosim the episode is simulated by the faster mesoscopic model, with the same observation and reward code
+        (the mesoscopic cars have no accumulated waiting time, the reward and the wait channel use their current waiting time)
         """
         start_time = timeit.default_timer()
 
         # first, generate the route file for this simulation and set up sumo
         self._TrafficGen.generate_routefile(seed=episode)
-        traci.start(self._sumo_cmd)
+        traci.start(self._sumo_cmd + MESOSIM_OPTIONS if mesosim else self._sumo_cmd)
         print("Simulating...")
 
         # inits
         self._step = 0
-        self._waiting_times = {}
+        self._WaitingTimes.reset(mesosim)
         self._sum_neg_reward = 0
         self._sum_queue_length = 0
         self._sum_waiting_time = 0
@@ -59,8 +79,22 @@ class Simulation:
         old_state = -1
         old_action = -1
 
+        # optionally start from a pre-warmed traffic state instead of the empty network
+        if self._Snapshots is not None and self._warm_start_step > 0:
+            self._Snapshots.warm_start(seed=episode, step=self._warm_start_step, mesosim=mesosim)
+            self._step = self._warm_start_step
+            old_total_wait = self._collect_waiting_times()
+
+        self._StateEncoder.subscribe(mesosim)  # after the warm start, so that the subscription refers to the loaded state
+
         while self._step < self._max_steps:
 
+            # no car in the network and none departing soon: jump to the next departure instead of deciding every green interval
+            idle_steps = self._idle_steps()
+            if idle_steps > 0:
+                self._fast_forward(idle_steps)
+                continue
+
             # get current state of the intersection
             current_state = self._get_state()
 
@@ -72,15 +106,16 @@ class Simulation:
             print("Reward of the previous action = ", reward, " given that old total wait is ", old_total_wait, " and current total wait ", current_total_wait)
 
             # saving the data into the memory
-            if self._step != 0:
+            if old_action != -1:
                 self._Memory.add_sample((old_state, old_action, reward, current_state))
 
             # choose the light phase to activate, based on the current state of the intersection
             action = self._choose_action(current_state, epsilon)
+            self._decision_count += 1
             
 
             # if the chosen phase is different from the last phase, activate the yellow phase
-            if self._step != 0 and old_action != action:
+            if old_action != -1 and old_action != action:
                 #print("New action is different, new  = " + str(action) + ", old = " + str(old_action))
                 self._set_yellow_phase(old_action)
                 self._simulate(self._yellow_duration)
@@ -106,10 +141,12 @@ class Simulation:
         self._save_episode_stats()
         
 
-        print("Avg speed : ", self._avg_speed_store)
-        print("Cumulative wait store :", self._cumulative_wait_store)
-        print("Reward store : ", self.reward_store)
+        print("Avg speed : ", self._sum_avg_speed)
+        print("Cumulative wait :", self._sum_waiting_time)
+        print("Mean reward over the episodes : ", self._Metrics.stats('reward').mean)
         print("Total reward:", self._sum_neg_reward, "- Epsilon:", round(epsilon, 2))
+        print("Prediction cache:", self._Model.cache.report())
+        self._Model.cache.reset_stats()
         traci.close()
         simulation_time = round(timeit.default_timer() - start_time, 1)
 
@@ -139,22 +176,34 @@ class Simulation:
             self._sum_waiting_time += queue_length # 1 step while wating in queue means 1 second waited, for each car, therefore queue_lenght == waited_seconds
             self._sum_avg_speed = (self._sum_avg_speed + avg_speed) / 2
 
+    def _fast_forward(self, steps):
+        """
+        Skip idle steps with a single call to sumo, crediting them to the statistics in closed form:
+        no car is queued and the mean speed of the empty edges stays the same for every skipped step
+        """
+        avg_speed = self._get_avg_speed()
+        traci.simulationStep(traci.simulation.getTime() + steps)  # simulate until the given time
+        self._step += steps
+        self._sum_avg_speed = avg_speed + (self._sum_avg_speed - avg_speed) / 2 ** steps  # same as averaging 'steps' times with avg_speed
+
+    def _idle_steps(self):
+        """
+        Return how many steps can be skipped because the network is empty, no car is waiting to be inserted and none departs before
+        """
+        if not self._fast_forward_idle or traci.vehicle.getIDCount() > 0 or traci.simulation.getPendingVehicles():
+            return 0
+
+        next_departure = self._TrafficGen.next_departure(self._step)
+        if next_departure >= self._max_steps:
+            return self._max_steps - self._step
+        return max(0, int(math.floor(next_departure)) - self._step - 1)  # stop just before the departure
+
+
     def _collect_waiting_times(self):
         """
-        Retrieve the waiting time of every car in the incoming roads
+        Retrieve the total waiting time of the cars in the incoming roads, updated incrementally
         """
-        incoming_roads = ["East2Traffighlight", "North2TrafficLight", "WE2TrafficLight", "South2TrafficLight"]
-        car_list = traci.vehicle.getIDList()
-        for car_id in car_list:
-            wait_time = traci.vehicle.getAccumulatedWaitingTime(car_id)
-            road_id = traci.vehicle.getRoadID(car_id)  # get the road id where the car is located
-            if road_id in incoming_roads:  # consider only the waiting times of cars in incoming roads
-                self._waiting_times[car_id] = wait_time
-            else:
-                if car_id in self._waiting_times: # a car that was tracked has cleared the intersection
-                    del self._waiting_times[car_id] 
-        total_waiting_time = sum(self._waiting_times.values())
-        return total_waiting_time
+        return self._WaitingTimes.update()
 
     def _collect_avg_speed(self):
         """
@@ -237,124 +286,54 @@ class Simulation:
 
     def _get_state(self):
         """
-        Retrieve the state of the intersection from sumo, in the form of cell occupancy
+        Retrieve the state of the intersection from sumo, in the form of the configured channels (cell occupancy by default)
         """
-        state = np.zeros(self._num_states)
-        car_list = traci.vehicle.getIDList()
-
-        for car_id in car_list:
-            lane_pos = traci.vehicle.getLanePosition(car_id)
-            lane_id = traci.vehicle.getLaneID(car_id)
-            lane_pos = 750 - lane_pos  # inversion of lane pos, so if the car is close to the traffic light -> lane_pos = 0 --- 750 = max len of a road
-
-            # distance in meters from the traffic light -> mapping into cells
-            if lane_pos < 7:
-                lane_cell = 0
-            elif lane_pos < 14:
-                lane_cell = 1
-            elif lane_pos < 21:
-                lane_cell = 2
-            elif lane_pos < 28:
-                lane_cell = 3
-            elif lane_pos < 40:
-                lane_cell = 4
-            elif lane_pos < 60:
-                lane_cell = 5
-            elif lane_pos < 100:
-                lane_cell = 6
-            elif lane_pos < 160:
-                lane_cell = 7
-            elif lane_pos < 400:
-                lane_cell = 8
-            elif lane_pos <= 750:
-                lane_cell = 9
-
-            # finding the lane where the car is located 
-            if lane_id == "WE2TrafficLight_0" or lane_id == "WE2TrafficLight_1":
-                lane_group = 0
-            elif lane_id == "WE2TrafficLight_2":
-                lane_group = 1
-            elif lane_id == "North2TrafficLight_0" or lane_id == "North2TrafficLight_1":
-                lane_group = 2
-            elif lane_id == "North2TrafficLight_2":
-                lane_group = 3
-            elif lane_id == "East2TrafficLight_0" or lane_id == "East2TrafficLight_1":
-                lane_group = 4
-            elif lane_id == "East2TrafficLight_2":
-                lane_group = 5
-            elif lane_id == "South2TrafficLight_0" or lane_id == "South2TrafficLight_1":
-                lane_group = 6
-            elif lane_id == "South2TrafficLight_2":
-                lane_group = 7
-            else:
-                lane_group = -1
-
-            if lane_group >= 1 and lane_group <= 7:
-                car_position = int(str(lane_group) + str(lane_cell))  # composition of the two postion ID to create a number in interval 0-79
-                valid_car = True
-            elif lane_group == 0:
-                car_position = lane_cell
-                valid_car = True
-            else:
-                valid_car = False  # flag for not detecting cars crossing the intersection or driving away from it
-
-            if valid_car:
-                state[car_position] = 1  # write the position of the car car_id in the state array in the form of "cell occupied"
-
-        return state
+        return self._StateEncoder.encode()
 
 
     def _replay(self):
         """
         Retrieve a group of samples from the memory and for each of them update the learning equation, then train
         """
-        batch = self._Memory.get_samples(self._Model.batch_size)
-
-        if len(batch) > 0:  # if the memory is full enough
-            states = np.array([val[0] for val in batch])  # extract states from the batch
-            next_states = np.array([val[3] for val in batch])  # extract next states from the batch
+        if self._target_update_interval > 0:
+            # the max Q(next_state) of the frozen target network are cached in the memory, recomputed in bulk at every sync
+            # (only when a batch is trained, the batch count does not move while the memory is not full enough)
+            if self._batch_count % self._target_update_interval == 0 and self._Memory.is_full_enough():
+                self._Model.sync_target()
+                self._Memory.update_targets(self._Model.predict_target)
+            states, actions, rewards, max_q_next = self._Memory.get_samples_with_targets(self._Model.batch_size, self._Model.predict_target)
+        else:
+            states, actions, rewards, next_states = self._Memory.get_samples(self._Model.batch_size)
 
+        if len(states) > 0:  # if the memory is full enough
             # prediction
             q_s_a = self._Model.predict_batch(states)  # predict Q(state), for every sample
-            q_s_a_d = self._Model.predict_batch(next_states)  # predict Q(next_state), for every sample
-
-            # setup training arrays
-            x = np.zeros((len(batch), self._num_states))
-            y = np.zeros((len(batch), self._num_actions))
+            if self._target_update_interval == 0:
+                max_q_next = np.amax(self._Model.predict_batch(next_states), axis=1)  # predict Q(next_state), for every sample
 
-            for i, b in enumerate(batch):
-                state, action, reward, _ = b[0], b[1], b[2], b[3]  # extract data from one sample
-                current_q = q_s_a[i]  # get the Q(state) predicted before
-                current_q[action] = reward + self._gamma * np.amax(q_s_a_d[i])  # update Q(state, action)
-                x[i] = state
-                y[i] = current_q  # Q(state) that includes the updated action value
+            # update Q(state, action) of every sample, the other action values stay as predicted
+            q_s_a[np.arange(len(states)), actions] = rewards + self._gamma * max_q_next
 
-            self._Model.train_batch(x, y)  # train the NN
+            self._Model.train_batch(states, q_s_a)  # train the NN
+            self._batch_count += 1
 
 
     def _save_episode_stats(self):
         """
-        Save the stats of the episode to plot the graphs at the end of the session
+        Stream the stats of the episode to disk, so that the session can be monitored while running
         """
-        self._reward_store.append(self._sum_neg_reward)  # how much negative reward in this episode
-        self._cumulative_wait_store.append(self._sum_waiting_time)  # total number of seconds waited by cars in this episode
-        self._avg_queue_length_store.append(self._sum_queue_length / self._max_steps)  # average number of queued cars per step, in this episode
-        self._avg_speed_store.append(self._sum_avg_speed)
-
-    @property
-    def reward_store(self):
-        return self._reward_store
+        self._Metrics.append('reward', self._sum_neg_reward)  # how much negative reward in this episode
+        self._Metrics.append('delay', self._sum_waiting_time)  # total number of seconds waited by cars in this episode
+        self._Metrics.append('queue', self._sum_queue_length / self._max_steps)  # average number of queued cars per step, in this episode
+        self._Metrics.append('avg_speed', self._sum_avg_speed)
+        self._Metrics.flush()
 
 
     @property
-    def cumulative_wait_store(self):
-        return self._cumulative_wait_store
+    def decision_count(self):
+        return self._decision_count
 
 
     @property
-    def avg_queue_length_store(self):
-        return self._avg_queue_length_store
-
-    @property
-    def avg_speed_store(self):
-        return self._avg_speed_store
+    def batch_count(self):
+        return self._batch_count
@@ -2,6 +2,14 @@ import configparser
 from sumolib import checkBinary
 import os
 import sys
+import shutil
+import subprocess
+
+from state_encoder import get_num_states
+from registry import RunRegistry
+
+# mesoscopic simulation with the junction model, so that the cars still stop at the red lights
+MESOSIM_OPTIONS = ["--mesosim", "true", "--meso-junction-control", "true"]
 
 def import_train_configuration(config_file):
     """
@@ -14,20 +22,33 @@ def import_train_configuration(config_file):
     config['total_episodes'] = content['simulation'].getint('total_episodes')
     config['max_steps'] = content['simulation'].getint('max_steps')
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
+    config['counts_file'] = content['simulation'].get('counts_file', fallback='')
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
+    config['warm_start_step'] = content['simulation'].getint('warm_start_step', fallback=0)
+    config['fast_forward_idle'] = content['simulation'].getboolean('fast_forward_idle', fallback=False)
+    config['meso_episodes'] = content['simulation'].getint('meso_episodes', fallback=0)
+    config['metrics_buffer_size'] = content['simulation'].getint('metrics_buffer_size', fallback=1000)
     config['num_layers'] = content['model'].getint('num_layers')
     config['width_layers'] = content['model'].getint('width_layers')
     config['batch_size'] = content['model'].getint('batch_size')
     config['learning_rate'] = content['model'].getfloat('learning_rate')
     config['training_epochs'] = content['model'].getint('training_epochs')
+    config['target_update_interval'] = content['model'].getint('target_update_interval', fallback=0)
+    config['export_precisions'] = [precision.strip() for precision in content['model'].get('export_precisions', fallback='').split(',') if precision.strip()]
+    config['calibration_states'] = content['model'].getint('calibration_states', fallback=1000)
     config['memory_size_min'] = content['memory'].getint('memory_size_min')
-    config['memory_size_max'] = content['memory'].getint('memory_size_max')
-    config['num_states'] = content['agent'].getint('num_states')
+    config['memory_size_max'] = int(content['memory'].getfloat('memory_size_max'))  # can be written as 5e6 for large buffers
+    config['export_transitions'] = content['memory'].getboolean('export_transitions', fallback=False)
+    config['state_channels'] = [channel.strip() for channel in content['agent'].get('state_channels', fallback='occupancy').split(',')]
+    config['num_states'] = get_num_states(config['state_channels'])  # derived from the channels of the state
     config['num_actions'] = content['agent'].getint('num_actions')
     config['gamma'] = content['agent'].getfloat('gamma')
+    config['prediction_cache_size'] = content['agent'].getint('prediction_cache_size', fallback=0)
     config['models_path_name'] = content['dir']['models_path_name']
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
+    config['snapshots_path_name'] = content['dir'].get('snapshots_path_name', fallback='snapshots')
+    config.update(import_resources_configuration(content))
     return config
 
 
@@ -41,18 +62,89 @@ def import_test_configuration(config_file):
     config['gui'] = content['simulation'].getboolean('gui')
     config['max_steps'] = content['simulation'].getint('max_steps')
     config['n_cars_generated'] = content['simulation'].getint('n_cars_generated')
+    config['counts_file'] = content['simulation'].get('counts_file', fallback='')
     config['episode_seed'] = content['simulation'].getint('episode_seed')
+    config['metrics_buffer_size'] = content['simulation'].getint('metrics_buffer_size', fallback=1000)
     config['green_duration'] = content['simulation'].getint('green_duration')
     config['yellow_duration'] = content['simulation'].getint('yellow_duration')
-    config['num_states'] = content['agent'].getint('num_states')
+    config['warm_start_step'] = content['simulation'].getint('warm_start_step', fallback=0)
+    config['fast_forward_idle'] = content['simulation'].getboolean('fast_forward_idle', fallback=False)
+    config['state_channels'] = [channel.strip() for channel in content['agent'].get('state_channels', fallback='occupancy').split(',')]
+    config['num_states'] = get_num_states(config['state_channels'])  # derived from the channels of the state
     config['num_actions'] = content['agent'].getint('num_actions')
+    config['prediction_cache_size'] = content['agent'].getint('prediction_cache_size', fallback=0)
+    config['model_precision'] = content['agent'].get('model_precision', fallback='float32')
     config['sumocfg_file_name'] = content['dir']['sumocfg_file_name']
     config['models_path_name'] = content['dir']['models_path_name']
     config['model_to_test'] = content['dir'].getint('model_to_test') 
+    config['snapshots_path_name'] = content['dir'].get('snapshots_path_name', fallback='snapshots')
+    config.update(import_resources_configuration(content))
+    return config
+
+
+def import_resources_configuration(content):
+    """
+    Read the optional [resources] section, shared by the training and testing config files
+    """
+    config = {}
+    config['learner_cores'] = content.get('resources', 'learner_cores', fallback='')
+    config['sumo_cores'] = content.get('resources', 'sumo_cores', fallback='')
+    config['intra_op_threads'] = content.getint('resources', 'intra_op_threads', fallback=0)
+    config['inter_op_threads'] = content.getint('resources', 'inter_op_threads', fallback=0)
+    config['core_budget'] = content.get('resources', 'core_budget', fallback='')
+    config['parallel_jobs'] = content.getint('resources', 'parallel_jobs', fallback=1)
+    config['sumo_cores_per_job'] = content.getint('resources', 'sumo_cores_per_job', fallback=1)
     return config
 
 
-def set_sumo(gui, sumocfg_file_name, max_steps):
+def parse_cores(cores):
+    """
+    Convert a list of cores written as "0-3,6" into the list of core ids [0, 1, 2, 3, 6]
+    """
+    core_ids = []
+    for part in cores.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            core_ids.extend(range(int(first), int(last) + 1))
+        else:
+            core_ids.append(int(part))
+    return core_ids
+
+
+def get_available_cores():
+    """
+    Return the cores the process can run on, all the cores of the machine where the affinity cannot be read (Windows, macOS)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def set_resources(learner_cores, intra_op_threads, inter_op_threads):
+    """
+    Pin the process to the learner cores and size the tensorflow thread pools, must be called before the model is built
+    if the number of intra-op threads is not set, it is the number of learner cores
+    """
+    import tensorflow as tf
+
+    cores = parse_cores(learner_cores)
+    if cores:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        else:
+            print("Warning: pinning to cores is not supported on this platform, only the number of threads is limited")
+        if intra_op_threads == 0:
+            intra_op_threads = len(cores)
+    if intra_op_threads > 0:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def set_sumo(gui, sumocfg_file_name, max_steps, route_file=None, sumo_cores=''):
     """
     Configure various parameters of SUMO
     """
@@ -73,37 +165,42 @@ def set_sumo(gui, sumocfg_file_name, max_steps):
  
     # setting the cmd command to run sumo at simulation time
     sumo_cmd = [sumoBinary, "-c", os.path.join('intersection', sumocfg_file_name), "--no-step-log", "true", "--waiting-time-memory", str(max_steps)]
+    if route_file is not None:
+        sumo_cmd += ["--route-files", route_file]  # overrides the route file of the sumocfg
+    if sumo_cores:
+        if shutil.which("taskset"):
+            sumo_cmd = ["taskset", "-c", sumo_cores] + sumo_cmd  # keep sumo off the cores of the learner
+        else:
+            print("Warning: taskset is not available on this platform, sumo is not pinned to its cores")
 
     return sumo_cmd
 
 def set_train_path(models_path_name):
     """
-    Create a new model path with an incremental integer, also considering previously created model paths
+    Create a new model path with an incremental integer, allocated atomically by the run registry of the models folder
     """
     models_path = os.path.join(os.getcwd(), models_path_name, '')
-    os.makedirs(os.path.dirname(models_path), exist_ok=True)
+    _, data_path = RunRegistry(models_path).allocate_run()
+    return data_path
 
-    dir_content = os.listdir(models_path)
-    if dir_content:
-        previous_versions = [int(name.split("_")[1]) for name in dir_content]
-        new_version = str(max(previous_versions) + 1)
-    else:
-        new_version = '1'
-
-    data_path = os.path.join(models_path, 'model_'+new_version, '')
-    os.makedirs(os.path.dirname(data_path), exist_ok=True)
-    return data_path 
 
-
-def set_test_path(models_path_name, model_n):
+def set_test_path(models_path_name, model_n, test_folder='test'):
     """
     Returns a model path that identifies the model number provided as argument and a newly created 'test' path
     """
     model_folder_path = os.path.join(os.getcwd(), models_path_name, 'model_'+str(model_n), '')
 
     if os.path.isdir(model_folder_path):    
-        plot_path = os.path.join(model_folder_path, 'test', '')
+        plot_path = os.path.join(model_folder_path, test_folder, '')
         os.makedirs(os.path.dirname(plot_path), exist_ok=True)
         return model_folder_path, plot_path
     else: 
-        sys.exit('The model number specified does not exist in the models folder')
\ No newline at end of file
+        sys.exit('The model number specified does not exist in the models folder')
+
+
+def launch_plotter(path):
+    """
+    Render the plots of the folder in a separate process, so that the caller never imports or waits for matplotlib
+    """
+    plotter = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plotter.py')
+    return subprocess.Popen([sys.executable, plotter, path])
@@ -1,3 +1,5 @@
+import matplotlib
+matplotlib.use('Agg')  # non-interactive backend, plots are only saved to file
 import matplotlib.pyplot as plt
 import os
 
@@ -11,6 +13,27 @@ class Visualization:
         """
         Produce a plot of performance of the agent over the session and save the relative data to txt
         """
+        self._plot(data, filename, xlabel, ylabel)
+
+        with open(os.path.join(self._path, 'plot_'+filename + '_data.txt'), "w") as file:
+            for value in data:
+                    file.write("%s\n" % value)
+
+
+    def plot_data_file(self, filename, xlabel, ylabel):
+        """
+        Produce a plot from the data already saved to txt (e.g. streamed by the metrics sink)
+        """
+        with open(os.path.join(self._path, 'plot_'+filename + '_data.txt'), "r") as file:
+            data = [float(line) for line in file if line.strip()]
+
+        self._plot(data, filename, xlabel, ylabel)
+
+
+    def _plot(self, data, filename, xlabel, ylabel):
+        """
+        Draw the data and save the figure as png
+        """
         min_val = min(data)
         max_val = max(data)
 
@@ -25,8 +48,4 @@ class Visualization:
         fig.set_size_inches(20, 11.25)
         fig.savefig(os.path.join(self._path, 'plot_'+filename+'.png'), dpi=self._dpi)
         plt.close("all")
-
-        with open(os.path.join(self._path, 'plot_'+filename + '_data.txt'), "w") as file:
-            for value in data:
-                    file.write("%s\n" % value)
-    
\ No newline at end of file
+    
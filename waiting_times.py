@@ -0,0 +1,56 @@
+import traci
+
+# incoming roads considered by the reward, "East2Traffighlight" is kept as it was in the original
+# (it is not an edge of the network, so the cars coming from east do not contribute to the waiting time)
+INCOMING_ROADS = ["East2Traffighlight", "North2TrafficLight", "WE2TrafficLight", "South2TrafficLight"]
+
+
+class WaitingTimeTracker:
+    def __init__(self, incoming_roads=INCOMING_ROADS):
+        self._incoming_roads = incoming_roads
+        self._edges = []
+        self._waiting_times = {}
+        self._total = 0
+        self._get_waiting_time = None
+
+
+    def reset(self, mesosim=False):
+        """
+        Forget every tracked car, to be called after sumo is started for a new episode
+        the accumulated waiting time is only implemented for microscopic cars, mesoscopic ones report their current waiting time
+        """
+        self._get_waiting_time = traci.vehicle.getWaitingTime if mesosim else traci.vehicle.getAccumulatedWaitingTime
+        network_edges = set(traci.edge.getIDList())
+        self._edges = [road_id for road_id in self._incoming_roads if road_id in network_edges]
+        self._waiting_times = {}
+        self._total = 0
+
+
+    def update(self):
+        """
+        Update the waiting time of the cars in the incoming roads, only the cars on those edges are queried
+        and the total is kept as a running sum instead of being recomputed from scratch
+        """
+        on_incoming = set()
+        for road_id in self._edges:
+            for car_id in traci.edge.getLastStepVehicleIDs(road_id):
+                on_incoming.add(car_id)
+                wait_time = max(self._get_waiting_time(car_id), 0)  # an unsupported value would be a large negative sentinel
+                self._total += wait_time - self._waiting_times.get(car_id, 0)
+                self._waiting_times[car_id] = wait_time
+
+        left = [car_id for car_id in self._waiting_times if car_id not in on_incoming]
+        for car_id in left:  # only the cars that left are queried, not every car of the network
+            wait_time = self._waiting_times.pop(car_id)
+            try:
+                traci.vehicle.getRoadID(car_id)
+            except traci.TraCIException:
+                continue  # the car has already arrived: as before, its last waiting time stays in the total
+            self._total -= wait_time  # a car that was tracked has cleared the intersection
+
+        return self._total
+
+
+    @property
+    def total(self):
+        return self._total